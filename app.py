@@ -1,19 +1,224 @@
 import streamlit as st
+import logging
 import os
 import sys
 from pathlib import Path
 from PIL import Image
 import time
-import cv2
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.preprocessing.image_processor import ImagePreprocessor
-from src.preprocessing.diagram_detector import DiagramDetector
-from src.ocr.hybrid_ocr import HybridOCR
-from src.postprocessing.llm_corrector import LLMCorrector
-from src.document_generation.word_generator import WordGenerator
+
+# Cached resource factories - constructed once per process and shared across reruns.
+# Pipeline modules (cv2, torch, groq, docx) are imported inside the factories so that
+# sidebar interactions, which rerun this script, never walk their import graphs.
+@st.cache_resource
+def get_ocr_engine(prefer_local, force_model, quantize=False):
+    from src.ocr.hybrid_ocr import HybridOCR
+    return HybridOCR(prefer_local=prefer_local, local_model=force_model or "auto", quantize=quantize)
+
+
+@st.cache_resource
+def get_llm_corrector():
+    from src.postprocessing.llm_corrector import LLMCorrector
+    return LLMCorrector()
+
+
+@st.cache_resource
+def get_word_generator():
+    from src.document_generation.word_generator import WordGenerator
+    return WordGenerator()
+
+
+@st.cache_resource
+def get_preprocessor():
+    from src.preprocessing.image_processor import ImagePreprocessor
+    return ImagePreprocessor()
+
+
+@st.cache_resource
+def get_diagram_detector():
+    from src.preprocessing.diagram_detector import DiagramDetector
+    return DiagramDetector()
+
+
+@st.cache_resource
+def get_ocr_cache():
+    from src.ocr.ocr_cache import OCRResultCache
+    return OCRResultCache()
+
+
+CSS_PATH = Path(__file__).parent / "static" / "app.css"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+THUMBNAIL_SIZE = (300, 300)
+DIAGRAM_PREVIEW_SIZE = (400, 400)
+LLM_CACHE_ENTRIES = 64
+
+
+@st.cache_resource
+def configure_logging():
+    """Pipeline modules log instead of printing; LOG_LEVEL=INFO shows their progress in the console"""
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(), format="%(message)s")
+    return True
+
+
+@st.cache_resource
+def ensure_dirs():
+    """Create working directories once per process"""
+    for directory in ("uploads", "outputs", "temp", "cache/ocr"):
+        os.makedirs(directory, exist_ok=True)
+    return True
+
+
+@st.cache_resource
+def load_css():
+    return CSS_PATH.read_text(encoding="utf-8")
+
+
+def upload_digest(uploaded_file):
+    """Content digest of an upload (hashes the in-memory buffer without copying it)"""
+    return hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest()
+
+
+def save_upload(uploaded_file, file_path):
+    """Stream an upload to disk in chunks"""
+    uploaded_file.seek(0)
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, length=UPLOAD_CHUNK_SIZE)
+
+
+def map_pages(func, *page_args):
+    """Run func over every page concurrently, returning results in page order"""
+    n_pages = len(page_args[0])
+    if n_pages <= 1:
+        return list(map(func, *page_args))
+    
+    # Worker threads need the script context to use st.cache_data
+    ctx = get_script_run_ctx()
+    max_workers = min(n_pages, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        return list(executor.map(func, *page_args))
+
+
+def load_thumbnail(source, size=THUMBNAIL_SIZE):
+    """Decode an image (path or file object) straight to a small RGB preview"""
+    image = Image.open(source)
+    # JPEGs decode at reduced scale; a no-op for other formats
+    image.draft("RGB", (size[0] * 2, size[1] * 2))
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    return image
+
+
+@st.cache_data(max_entries=8)
+def load_output_bytes(path, mtime):
+    """Read a generated document; mtime is part of the key so a rewritten file is reread"""
+    return Path(path).read_bytes()
+
+
+def build_pipeline(prefer_local, force_model, quantize, use_llm, detect_diagrams):
+    """Per-session pipeline handle over the process-wide cached components"""
+    return {
+        'ocr_engine': get_ocr_engine(prefer_local, force_model, quantize),
+        'llm_corrector': get_llm_corrector() if use_llm else None,
+        'word_generator': get_word_generator(),
+        'diagram_detector': get_diagram_detector() if detect_diagrams else None,
+    }
+
+
+# Content-addressed result caches - keyed on the upload digest, not its file name
+# (arguments prefixed with "_" are excluded from the cache key)
+@st.cache_data(ttl=3600, max_entries=64)
+def cached_preprocess(digest, _image_path):
+    # Only the path is cached - the decoded array would be pickled into the cache for nothing
+    _, preprocessed_path = get_preprocessor().preprocess(_image_path, output_name=f"preprocessed_{digest}.png")
+    return preprocessed_path
+
+
+@st.cache_data(ttl=3600, max_entries=64)
+def cached_ocr(digest, prefer_local, force_model, quantize, _image_path):
+    return get_ocr_engine(prefer_local, force_model, quantize).extract_text_from_image(_image_path)
+
+
+def ocr_pages(cache_keys, image_paths, prefer_local, force_model, quantize=False):
+    """
+    OCR every page, skipping pages whose result is already cached on disk
+    
+    Returns:
+        (results in page order, number of pages served from the disk cache)
+    """
+    ocr_cache = get_ocr_cache()
+    model_key = f"{'local' if prefer_local else 'api'}_{force_model or 'auto'}{'_int8' if quantize else ''}"
+    
+    results = [ocr_cache.get(key, model_key) for key in cache_keys]
+    pending = [idx for idx, result in enumerate(results) if result is None]
+    
+    if len(pending) > 1 and force_model in ("api", "florence", "got"):
+        # Local GPU model: read the pending pages in batched generate calls
+        # (API: all pending requests in flight at once on one event loop)
+        fresh = get_ocr_engine(prefer_local, force_model, quantize).extract_text_batch(
+            [image_paths[idx] for idx in pending]
+        )
+    else:
+        fresh = map_pages(
+            lambda idx: cached_ocr(cache_keys[idx], prefer_local, force_model, quantize, image_paths[idx]),
+            pending
+        )
+    for idx, result in zip(pending, fresh):
+        results[idx] = result
+        ocr_cache.put(cache_keys[idx], model_key, result)
+    
+    return results, len(cache_keys) - len(pending)
+
+
+def needs_retry(ocr_result):
+    """OCR result too short to trust - worth trying the preprocessed image"""
+    return not ocr_result.get('text') or len(ocr_result['text']) < 50
+
+
+def pick_better_result(*ocr_results):
+    """Keep the OCR result with the most text, breaking ties on confidence"""
+    return max(ocr_results, key=lambda r: (len(r.get('text') or ''), r.get('confidence', 0)))
+
+
+@st.cache_data(ttl=3600, max_entries=64)
+def cached_llm_correct_pages(page_texts):
+    return get_llm_corrector().correct_pages(list(page_texts))
+
+
+@st.cache_resource
+def get_structured_text_cache():
+    """Streamed correct + structure results by OCR text (st.cache_data can't wrap a stream)"""
+    return {}
+
+
+def stream_llm_correct_and_structure(text):
+    """
+    Correct and structure one page, showing the markdown as it streams in
+    The hallucination check runs on the complete response; results are cached per text
+    """
+    cache = get_structured_text_cache()
+    if text in cache:
+        return cache[text]
+    
+    llm_corrector = get_llm_corrector()
+    streamed = st.write_stream(llm_corrector.correct_and_structure_stream(text))
+    structured_text = llm_corrector.validate_text(streamed, text) if streamed else text
+    
+    if len(cache) >= LLM_CACHE_ENTRIES:
+        cache.pop(next(iter(cache)))  # oldest first
+    cache[text] = structured_text
+    return structured_text
+
+
+@st.cache_data(ttl=3600, max_entries=64)
+def cached_llm_structure(text):
+    return get_llm_corrector().structure_content(text)
+
 
 # Page config
 st.set_page_config(
@@ -23,44 +228,26 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS (keep your existing CSS)
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 3rem;
-        font-weight: bold;
-        text-align: center;
-        background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        margin-bottom: 2rem;
-    }
-    .stProgress > div > div > div > div {
-        background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-    }
-    .success-box {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        background-color: #d4edda;
-        border: 1px solid #c3e6cb;
-        color: #155724;
-    }
-</style>
-""", unsafe_allow_html=True)
+configure_logging()
+ensure_dirs()
+
+# Custom CSS - read from disk once per process; Streamlit drops elements that a
+# rerun doesn't emit, so the (small) <style> tag is still written every run
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
 
 # Initialize session state
 if 'processed' not in st.session_state:
     st.session_state.processed = False
 if 'output_path' not in st.session_state:
     st.session_state.output_path = None
+    st.session_state.output_stat = None
 if 'ocr_info' not in st.session_state:
     st.session_state.ocr_info = {}
 if 'diagram_info' not in st.session_state:
     st.session_state.diagram_info = {}
-if 'ocr_engine' not in st.session_state:
-    st.session_state.ocr_engine = None
-if 'current_model' not in st.session_state:
-    st.session_state.current_model = None
+if 'pipeline' not in st.session_state:
+    st.session_state.pipeline = None
+    st.session_state.pipeline_key = None
 
 # Header
 st.markdown('<h1 class="main-header">📝 Handwriting to Word Converter</h1>', unsafe_allow_html=True)
@@ -129,6 +316,11 @@ with st.sidebar:
         try_preprocessed = st.checkbox("Retry with Preprocessed", value=True)
         show_preview = st.checkbox("Show Text Preview", value=True)
         show_diagrams = st.checkbox("Show Detected Diagrams", value=True)
+        quantize_models = st.checkbox(
+            "Quantize Local Models (int8)",
+            value=False,
+            help="Load Florence-2 / GOT-OCR with int8 weights: about half the memory and faster, at a small accuracy cost"
+        )
     
     st.divider()
     
@@ -163,10 +355,14 @@ with st.sidebar:
         - Reliable fallback
         """)
     
+    if quantize_models and ocr_model in ("Florence-2 Local", "GOT-OCR 2.0 Local", "Auto (Smart Fallback)"):
+        st.caption("⚖️ int8 quantization halves model memory and speeds up inference, "
+                   "but may slightly reduce accuracy on faint or messy handwriting.")
+    
     # API Status
     st.subheader("🔑 API Status")
-    groq_key = os.getenv('GROQ_API_KEY')
-    if groq_key:
+    from src.config import GROQ_API_KEY
+    if GROQ_API_KEY:
         st.success("✅ Groq API Key Found")
     else:
         st.warning("⚠️ No Groq API Key")
@@ -190,8 +386,8 @@ with col1:
         cols = st.columns(min(len(uploaded_files), 3))
         for idx, uploaded_file in enumerate(uploaded_files[:3]):
             with cols[idx]:
-                image = Image.open(uploaded_file)
-                st.image(image, use_column_width=True, caption=uploaded_file.name)
+                uploaded_file.seek(0)
+                st.image(load_thumbnail(uploaded_file), use_column_width=True, caption=uploaded_file.name)
 
 with col2:
     st.subheader("💾 Output Settings")
@@ -214,28 +410,34 @@ if uploaded_files:
         status_text = st.empty()
         log_container = st.expander("📋 Processing Log", expanded=True)
         
-        # Save uploaded files
-        os.makedirs("uploads", exist_ok=True)
-        os.makedirs("outputs", exist_ok=True)
-        os.makedirs("temp", exist_ok=True)
-        
         # Save uploaded files with timestamp to avoid conflicts
-        import time
         timestamp = int(time.time())
         
         image_paths = []
+        image_digests = []
+        seen_digests = {}
+        duplicates = []
         for idx, uploaded_file in enumerate(uploaded_files):
+            # Identical uploads (e.g. same scan under another name) are processed once
+            digest = upload_digest(uploaded_file)
+            if digest in seen_digests:
+                duplicates.append((uploaded_file.name, seen_digests[digest]))
+                continue
+            seen_digests[digest] = uploaded_file.name
+            
             # Use timestamp to ensure unique filenames
             file_ext = os.path.splitext(uploaded_file.name)[1]
             file_path = f"uploads/{timestamp}_{idx}_{uploaded_file.name}"
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            save_upload(uploaded_file, file_path)
             image_paths.append(file_path)
+            image_digests.append(digest)
             
         with log_container:
             st.write(f"📁 Saved {len(image_paths)} file(s):")
             for path in image_paths:
                 st.write(f"   - {os.path.basename(path)}")
+            for name, original in duplicates:
+                st.write(f"   ⏭️ Skipped {name} (duplicate of {original})")
         
         try:
             # Initialize pipeline
@@ -244,89 +446,105 @@ if uploaded_files:
             status_text.text("🔧 Initializing pipeline...")
             progress_bar.progress(10)
             
-            preprocessor = ImagePreprocessor()
-            diagram_detector = DiagramDetector() if detect_diagrams else None
-            
-            # Reuse OCR engine if same model, otherwise create new one
-            model_key = f"{prefer_local}_{force_model if force_model else 'auto'}"
-            if st.session_state.current_model != model_key or st.session_state.ocr_engine is None:
+            # Model weights are shared per process; the session only rebuilds its
+            # pipeline handle when the configuration changes
+            pipeline_key = (prefer_local, force_model, quantize_models, use_llm, detect_diagrams)
+            if st.session_state.pipeline_key != pipeline_key:
                 with log_container:
                     st.write(f"📥 Loading OCR model: {ocr_model}...")
-                if st.session_state.ocr_engine:
-                    st.session_state.ocr_engine.cleanup()
-                st.session_state.ocr_engine = HybridOCR(prefer_local=prefer_local, local_model=force_model if force_model else "auto")
-                st.session_state.current_model = model_key
+                st.session_state.pipeline = build_pipeline(*pipeline_key)
+                st.session_state.pipeline_key = pipeline_key
             else:
                 with log_container:
-                    st.write(f"♻️ Reusing cached OCR model: {ocr_model}")
+                    st.write(f"♻️ Reusing pipeline: {ocr_model}")
             
-            ocr_engine = st.session_state.ocr_engine
-            llm_corrector = LLMCorrector() if use_llm else None
-            word_generator = WordGenerator()
+            pipeline = st.session_state.pipeline
+            diagram_detector = pipeline['diagram_detector']
+            ocr_engine = pipeline['ocr_engine']
+            llm_corrector = pipeline['llm_corrector']
+            word_generator = pipeline['word_generator']
             
             progress_bar.progress(20)
             
-            # Process all uploaded images (or just first if multiple)
-            if len(image_paths) > 1:
-                with log_container:
-                    st.write(f"📚 Processing {len(image_paths)} images...")
-                    st.write("   (Currently processing first image only)")
-            
-            img_path = image_paths[0]
-            
             with log_container:
-                st.write(f"📸 Processing: {os.path.basename(img_path)}")
-            status_text.text(f"📸 Processing {os.path.basename(img_path)}...")
+                st.write(f"📚 Processing {len(image_paths)} image(s)...")
             
-            # Step 1: Preprocessing
+            # Steps 1-3 have no data dependency on each other: preprocessing and
+            # diagram detection run in the background while OCR reads the originals
             with log_container:
-                st.write("STEP 1: Preprocessing...")
-            preprocessed_img, preprocessed_path = preprocessor.preprocess(img_path)
-            progress_bar.progress(30)
+                if force_model != "api":
+                    st.write("STEP 1: Preprocessing (background)...")
+                if detect_diagrams and diagram_detector:
+                    st.write("STEP 2: Detecting diagrams (background)...")
+                st.write("STEP 3: Running OCR...")
+            status_text.text(f"🔍 Running OCR on {len(image_paths)} image(s)...")
             
-            # Step 2: Diagram detection
-            diagrams = []
-            if detect_diagrams and diagram_detector:
-                with log_container:
-                    st.write("STEP 2: Detecting diagrams...")
-                status_text.text("🔍 Detecting diagrams...")
-                diagram_result = diagram_detector.detect_and_extract(img_path)
+            with ThreadPoolExecutor(max_workers=4, initializer=add_script_run_ctx,
+                                    initargs=(None, get_script_run_ctx())) as background:
+                # The vision API reads the originals (VisionOCR only downscales them) - a
+                # thresholded copy doesn't help it, so API-only runs skip preprocessing entirely
+                preprocess_future = None
+                if force_model != "api":
+                    preprocess_future = background.submit(
+                        lambda: [cached_preprocess(digest, path) for digest, path in zip(image_digests, image_paths)]
+                    )
+                diagram_future = None
+                if detect_diagrams and diagram_detector:
+                    diagram_future = background.submit(
+                        lambda: [diagram_detector.detect_and_extract(path) for path in image_paths]
+                    )
                 
-                if diagram_result.get('has_diagrams'):
-                    diagrams = diagram_result.get('diagram_regions', [])
+                # OCR the originals (all pages concurrently, results kept in page order)
+                original_future = background.submit(
+                    ocr_pages, image_digests, image_paths, prefer_local, force_model, quantize_models
+                )
+                
+                ocr_results, n_cached = original_future.result()
+                if n_cached:
                     with log_container:
-                        st.write(f"   Found {len(diagrams)} diagram(s)")
-                    st.session_state.diagram_info = {'count': len(diagrams)}
-                    
-                    if show_diagrams:
-                        with log_container:
-                            st.write("**Detected Diagrams:**")
-                            cols = st.columns(min(len(diagrams), 3))
-                            for idx, diag in enumerate(diagrams[:3]):
-                                with cols[idx]:
-                                    diag_img = cv2.imread(diag['path'])
-                                    diag_img_rgb = cv2.cvtColor(diag_img, cv2.COLOR_BGR2RGB)
-                                    st.image(diag_img_rgb, caption=f"Diagram {idx+1}", use_column_width=True)
-            
-            progress_bar.progress(40)
-            
-            # Step 3: OCR
-            with log_container:
-                st.write("STEP 3: Running OCR...")
-            status_text.text("🔍 Running OCR...")
+                        st.write(f"♻️ Loaded {n_cached} OCR result(s) from disk cache")
+                progress_bar.progress(40)
+                
+                # Only pages whose original OCR failed are read again, from the preprocessed
+                # image (already prepared in the background), keeping the better of the two passes
+                retry_pages = [idx for idx, result in enumerate(ocr_results) if needs_retry(result)]
+                if try_preprocessed and preprocess_future and retry_pages:
+                    with log_container:
+                        st.write(f"🔄 Using preprocessed version for {len(retry_pages)} image(s)...")
+                    preprocessed_paths = preprocess_future.result()
+                    retried, _ = ocr_pages(
+                        [f"{image_digests[idx]}_preprocessed" for idx in retry_pages],
+                        [preprocessed_paths[idx] for idx in retry_pages],
+                        prefer_local, force_model, quantize_models
+                    )
+                    for idx, result in zip(retry_pages, retried):
+                        ocr_results[idx] = pick_better_result(ocr_results[idx], result)
+                
+                diagram_results = diagram_future.result() if diagram_future else []
+                if preprocess_future:
+                    preprocess_future.result()
             
-            # Try original first
-            ocr_result = ocr_engine.extract_text_from_image(img_path)
+            diagrams = []
+            for diagram_result in diagram_results:
+                if diagram_result.get('has_diagrams'):
+                    diagrams.extend(diagram_result.get('diagram_regions', []))
             
-            # If failed and retry enabled, try preprocessed
-            if try_preprocessed and (not ocr_result.get('text') or len(ocr_result['text']) < 50):
+            if diagrams:
                 with log_container:
-                    st.write("🔄 Retrying with preprocessed image...")
-                ocr_result = ocr_engine.extract_text_from_image(preprocessed_path)
+                    st.write(f"   Found {len(diagrams)} diagram(s)")
+                st.session_state.diagram_info = {'count': len(diagrams)}
+                
+                if show_diagrams:
+                    with log_container:
+                        st.write("**Detected Diagrams:**")
+                        cols = st.columns(min(len(diagrams), 3))
+                        for idx, diag in enumerate(diagrams[:3]):
+                            with cols[idx]:
+                                st.image(load_thumbnail(diag['path'], DIAGRAM_PREVIEW_SIZE), caption=f"Diagram {idx+1}", use_column_width=True)
             
-            extracted_text = ocr_result.get('text', '')
-            confidence = ocr_result.get('confidence', 0)
-            method = ocr_result.get('method', 'unknown')
+            page_texts = [result.get('text', '') for result in ocr_results]
+            extracted_text = "\n\n".join(text for text in page_texts if text)
+            method = ", ".join(dict.fromkeys(result.get('method', 'unknown') for result in ocr_results))
             
             progress_bar.progress(60)
             
@@ -342,6 +560,9 @@ if uploaded_files:
                 st.write(f"   - Method: **{method}**")
                 # st.write(f"   - Confidence: **{confidence:.2%}**")
                 st.write(f"   - Text length: **{len(extracted_text)}** characters")
+                if len(page_texts) > 1:
+                    for path, text in zip(image_paths, page_texts):
+                        st.write(f"   - {os.path.basename(path)}: {len(text)} characters")
             
             if len(extracted_text) < 20:
                 st.error("❌ OCR failed to extract meaningful text!")
@@ -352,14 +573,27 @@ if uploaded_files:
                 with log_container:
                     st.text_area("📄 Extracted Text Preview:", extracted_text[:500] + "...", height=150)
             
+            # Build the Word document scaffold while the LLM round-trips are in flight
+            scaffold_executor = ThreadPoolExecutor(max_workers=1)
+            scaffold_future = scaffold_executor.submit(word_generator.new_document, output_name)
+            scaffold_executor.shutdown(wait=False)
+            
             # Step 4: LLM correction
             if use_llm and llm_corrector:
                 with log_container:
                     st.write("STEP 4: LLM post-processing...")
                 status_text.text("✨ Enhancing text with AI...")
                 
-                corrected_text = llm_corrector.correct_text(extracted_text)
-                structured_text = llm_corrector.structure_content(corrected_text)
+                texts = tuple(text for text in page_texts if text)
+                if len(texts) == 1:
+                    # Single page: correct and structure in one round trip, streamed to the log
+                    with log_container:
+                        structured_text = stream_llm_correct_and_structure(texts[0])
+                else:
+                    # Pages are corrected concurrently, then structured as one document
+                    corrected_pages = cached_llm_correct_pages(texts)
+                    corrected_text = "\n\n".join(corrected_pages)
+                    structured_text = cached_llm_structure(corrected_text)
                 progress_bar.progress(80)
             else:
                 structured_text = extracted_text
@@ -380,19 +614,22 @@ if uploaded_files:
             output_path = word_generator.create_document(
                 structured_text, 
                 output_name,
-                diagrams=diagrams_to_embed
+                diagrams=diagrams_to_embed,
+                doc=scaffold_future.result()
             )
             progress_bar.progress(100)
             
             # Success
             st.session_state.processed = True
             st.session_state.output_path = output_path
+            # Stat once here so the results panel doesn't touch the disk on every rerun
+            output_stat = os.stat(output_path)
+            st.session_state.output_stat = (output_path, output_stat.st_mtime, output_stat.st_size)
             status_text.empty()
             
             with log_container:
                 st.success(f"✅ SUCCESS! Document saved to: {output_path}")
             
-            time.sleep(0.5)
             st.balloons()
             
             # Don't cleanup - keep models cached for next run
@@ -428,14 +665,14 @@ if st.session_state.processed and st.session_state.output_path:
     # Download button
     col_dl1, col_dl2, col_dl3 = st.columns([1, 2, 1])
     with col_dl2:
-        if os.path.exists(st.session_state.output_path):
-            with open(st.session_state.output_path, "rb") as file:
-                st.download_button(
-                    label="⬇️ Download Word Document",
-                    data=file,
-                    file_name=f"{output_name}.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                )
+        if st.session_state.output_stat:
+            path, mtime, size = st.session_state.output_stat
+            st.download_button(
+                label=f"⬇️ Download Word Document ({size / 1024:.0f} KB)",
+                data=load_output_bytes(path, mtime),
+                file_name=f"{output_name}.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+            )
 
 # Footer
 st.divider()
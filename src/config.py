@@ -0,0 +1,14 @@
+import os
+from dotenv import load_dotenv
+
+# .env is read once per process; modules import the keys from here instead of
+# calling load_dotenv() / os.getenv() themselves
+load_dotenv()
+
+GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+MATHPIX_APP_ID = os.getenv('MATHPIX_APP_ID')
+MATHPIX_APP_KEY = os.getenv('MATHPIX_APP_KEY')
+
+# Optional: path of GOT-OCR's exported vision encoder - set it to run the encoder through
+# ONNX Runtime (exported there on first load if the file doesn't exist yet)
+GOT_VISION_ONNX = os.getenv('GOT_VISION_ONNX')
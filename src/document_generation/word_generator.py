@@ -1,17 +1,70 @@
+import logging
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from xml.sax.saxutils import escape
+import copy
+import io
 import os
 import re
 
+log = logging.getLogger(__name__)
+
+# Formula detection, fused into one alternation so each line is scanned once
+_FORMULA_RE = re.compile('|'.join((
+    r'[ΔΣ∫∂]',  # Math symbols
+    r'[→⇌≈≠≤≥]',  # Arrows and operators
+    r'\d+[A-Z][a-z]?\d*',  # Chemical formulas like H2O, CaCl2
+    r'[A-Za-z]+\d+',  # Subscripts
+)), re.ASCII)
+
+# Every formula pattern needs at least one of these characters; lines without
+# any of them (most prose) skip the regex entirely
+_FORMULA_CHARSET = frozenset('0123456789ΔΣ∫∂→⇌≈≠≤≥')
+
+# Markdown heading markers -> Word heading level
+_HEADING_LEVELS = {'#': 1, '##': 2, '###': 3}
+
+# Diagram sentinel kept in the text by the LLM structuring step (may sit mid-line)
+_DIAGRAM_MARKER = '[DIAGRAM]'
+
+# Layout units, built once
+_DIAGRAM_WIDTH = Inches(6)  # max width of embedded diagrams
+_CAPTION_SIZE = Pt(10)
+_EMBED_WIDTH = Inches(4)
+
+# Title -> file name: spaces and path separators become underscores in one pass
+_PATH_SAFE = str.maketrans({' ': '_', '/': '_', '\\': '_', ':': '_'})
+
 class WordGenerator:
     """Generate Word documents from processed text"""
     
+    # Blank python-docx document, parsed once per process and copied for every new document
+    _TEMPLATE = None
+    
     def __init__(self):
         self.output_dir = "outputs"
         os.makedirs(self.output_dir, exist_ok=True)
+        
+        if WordGenerator._TEMPLATE is None:
+            WordGenerator._TEMPLATE = Document()
     
-    def create_document(self, content, title="Converted Notes", diagrams=None):
+    def new_document(self, title="Converted Notes"):
+        """
+        Create the document scaffold (default styles + centered title)
+        Independent of the content, so it can be built while the text is still being processed
+        """
+        doc = copy.deepcopy(self._TEMPLATE)
+        
+        # Add title
+        title_para = doc.add_heading(title, 0)
+        title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        
+        return doc
+    
+    def create_document(self, content, title="Converted Notes", diagrams=None, doc=None):
         """
         Create Word document from structured content
         
@@ -19,12 +72,10 @@ class WordGenerator:
             content: Text content
             title: Document title
             diagrams: List of diagram dicts with 'path', 'bbox', 'center_y'
+            doc: Optional scaffold from new_document(title) to fill in
         """
-        doc = Document()
-        
-        # Add title
-        title_para = doc.add_heading(title, 0)
-        title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        if doc is None:
+            doc = self.new_document(title)
         
         # If we have diagrams, we need to insert them at appropriate positions
         if diagrams:
@@ -33,44 +84,83 @@ class WordGenerator:
             self._add_text_content(doc, content)
         
         # Save document
-        output_path = os.path.join(self.output_dir, f"{title.replace(' ', '_')}.docx")
-        doc.save(output_path)
+        output_path = os.path.join(self.output_dir, f"{title.translate(_PATH_SAFE)}.docx")
+        
+        # Build the zip in memory, then hand it to the file system in one write
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        with open(output_path, 'wb') as f:
+            f.write(buffer.getbuffer())
         
-        print(f"✅ Document saved: {output_path}")
+        log.info(f"✅ Document saved: {output_path}")
         return output_path
     
     def _add_text_content(self, doc, content):
-        """Add text content to document"""
+        """
+        Add text content to document
+        Paragraphs are built as one XML fragment and appended to the body in a single pass
+        """
         lines = content.split('\n')
+        paragraphs = []
         
         for line in lines:
             line = line.strip()
             if not line:
                 continue
             
-            # Check for headings
-            if line.startswith('# '):
-                doc.add_heading(line[2:], level=1)
-            elif line.startswith('## '):
-                doc.add_heading(line[3:], level=2)
-            elif line.startswith('### '):
-                doc.add_heading(line[4:], level=3)
+            # Check for headings (one lookup on the leading token)
+            marker, sep, heading = line.partition(' ')
+            level = _HEADING_LEVELS.get(marker) if sep else None
+            if level is not None:
+                paragraphs.append(self._paragraph_xml(heading, style=f"Heading{level}"))
             
-            # Check for diagrams
-            elif '[DIAGRAM]' in line:
-                p = doc.add_paragraph()
-                p.add_run('[Diagram placeholder - original image preserved]').italic = True
+            # Check for diagrams ('[' is a single-char memchr; most lines stop there)
+            elif '[' in line and _DIAGRAM_MARKER in line:
+                paragraphs.append(self._paragraph_xml('[Diagram placeholder - original image preserved]', italic=True))
             
             # Check for equations/formulas (basic detection)
             elif self._contains_formula(line):
-                p = doc.add_paragraph()
-                run = p.add_run(line)
-                run.font.name = 'Courier New'
-                run.font.size = Pt(10)
+                paragraphs.append(self._paragraph_xml(line, font='Courier New', size=10))
             
             # Regular text
             else:
-                doc.add_paragraph(line)
+                paragraphs.append(self._paragraph_xml(line))
+        
+        self._append_paragraphs(doc, paragraphs)
+    
+    def _paragraph_xml(self, text, style=None, italic=False, font=None, size=None):
+        """WordprocessingML for a single-run paragraph (same markup python-docx would produce)"""
+        ppr = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+        
+        rpr = ''
+        if font:
+            rpr += f'<w:rFonts w:ascii="{font}" w:hAnsi="{font}"/>'
+        if italic:
+            rpr += '<w:i/>'
+        if size:
+            rpr += f'<w:sz w:val="{int(size * 2)}"/>'  # half-points
+        if rpr:
+            rpr = f'<w:rPr>{rpr}</w:rPr>'
+        
+        # Tabs become <w:tab/> elements, as with python-docx's run.text
+        runs = '<w:tab/>'.join(
+            f'<w:t xml:space="preserve">{escape(part)}</w:t>' for part in text.split('\t')
+        )
+        return f'<w:p>{ppr}<w:r>{rpr}{runs}</w:r></w:p>'
+    
+    def _append_paragraphs(self, doc, paragraphs):
+        """Parse paragraph XML once and insert it at the end of the body (before sectPr)"""
+        if not paragraphs:
+            return
+        
+        fragment = parse_xml(f'<w:body {nsdecls("w")}>{"".join(paragraphs)}</w:body>')
+        body = doc.element.body
+        sect_pr = body.sectPr
+        for paragraph in list(fragment):
+            if sect_pr is not None:
+                sect_pr.addprevious(paragraph)
+            else:
+                body.append(paragraph)
     
     def _create_document_with_diagrams(self, doc, content, diagrams):
         """Create document with diagrams embedded at appropriate positions"""
@@ -81,47 +171,52 @@ class WordGenerator:
         doc.add_page_break()
         doc.add_heading("Diagrams and Figures", level=1)
         
-        for idx, diagram in enumerate(diagrams):
+        # Validate all diagram files in one pass, then embed without re-checking
+        present = [os.path.isfile(diagram['path']) for diagram in diagrams]
+        missing = [diagram['path'] for diagram, found in zip(diagrams, present) if not found]
+        if missing:
+            log.warning(f"⚠️ {len(missing)} diagram file(s) not found: {', '.join(missing)}")
+        
+        # Every diagram keeps its figure number (matching the [DIAGRAM] markers in the text),
+        # with a placeholder where its file is missing
+        for idx, (diagram, found) in enumerate(zip(diagrams, present)):
             # Add diagram heading
             doc.add_heading(f"Figure {idx + 1}", level=2)
             
-            # Add diagram image
-            if os.path.exists(diagram['path']):
-                try:
-                    # Calculate width (max 6 inches)
-                    doc.add_picture(diagram['path'], width=Inches(6))
-                    
-                    # Add caption
-                    caption = doc.add_paragraph()
-                    caption_run = caption.add_run(f"Figure {idx + 1}: Extracted diagram")
-                    caption_run.italic = True
-                    caption_run.font.size = Pt(10)
-                    caption.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    
-                    # Add spacing
-                    doc.add_paragraph()
-                    
-                except Exception as e:
-                    doc.add_paragraph(f"[Could not embed diagram: {e}]")
-            else:
+            if not found:
                 doc.add_paragraph(f"[Diagram file not found: {diagram['path']}]")
+                continue
+            
+            # Add diagram image
+            try:
+                # Calculate width (max 6 inches)
+                doc.add_picture(diagram['path'], width=_DIAGRAM_WIDTH)
+                
+                # Add caption
+                caption = doc.add_paragraph()
+                caption_run = caption.add_run(f"Figure {idx + 1}: Extracted diagram")
+                caption_run.italic = True
+                caption_run.font.size = _CAPTION_SIZE
+                caption.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                
+                # Add spacing
+                doc.add_paragraph()
+                
+            except Exception as e:
+                doc.add_paragraph(f"[Could not embed diagram: {e}]")
     
     def _contains_formula(self, text):
         """Detect if text contains chemical/math formulas"""
-        formula_patterns = [
-            r'\d+[A-Z][a-z]?\d*',  # Chemical formulas like H2O, CaCl2
-            r'[ΔΣ∫∂]',  # Math symbols
-            r'[A-Za-z]+\d+',  # Subscripts
-            r'→|⇌|≈|≠|≤|≥',  # Arrows and operators
-        ]
-        
-        return any(re.search(pattern, text) for pattern in formula_patterns)
+        if _FORMULA_CHARSET.isdisjoint(text):
+            return False
+        return _FORMULA_RE.search(text) is not None
     
-    def embed_image(self, doc, image_path, width=Inches(4)):
-        """Add image to document"""
+    def embed_image(self, doc, image_path, width=None):
+        """Add image to document (default width 4 inches)"""
+        width = width or _EMBED_WIDTH
         try:
             doc.add_picture(image_path, width=width)
             return True
         except Exception as e:
-            print(f"⚠️ Could not embed image: {e}")
+            log.warning(f"⚠️ Could not embed image: {e}")
             return False
\ No newline at end of file
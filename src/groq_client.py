@@ -0,0 +1,115 @@
+import logging
+import json
+import time
+import importlib.util
+import httpx
+from functools import lru_cache
+from groq import Groq
+from .config import GROQ_API_KEY
+
+log = logging.getLogger(__name__)
+
+# The Groq SDK retries connection errors, timeouts, 408/409/429 and 5xx with exponential
+# backoff (honouring Retry-After); other 4xx fail at once. Its default of 2 attempts is
+# too few to ride out the free tier's per-minute rate limit.
+MAX_RETRIES = 5
+
+_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# HTTP/2 multiplexes concurrent requests over one TLS connection (needs httpx[http2]);
+# without h2 installed the pool falls back to one HTTP/1.1 connection per in-flight request
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Sized for the concurrent batch paths (every page of a notebook in flight at once):
+# all connections may stay alive between batches, so later pages skip the TLS handshake
+_LIMITS = httpx.Limits(
+    max_connections=50,
+    max_keepalive_connections=50,
+    keepalive_expiry=60
+)
+
+
+@lru_cache(maxsize=1)
+def get_http_client():
+    """
+    HTTP connection pool shared by every Groq client in the process
+    Keep-alive connections (and their TLS sessions) are reused across OCR and LLM calls
+    """
+    return httpx.Client(timeout=_TIMEOUT, limits=_LIMITS, http2=_HTTP2)
+
+
+@lru_cache(maxsize=1)
+def get_groq_client():
+    """
+    Groq client shared by VisionOCR and LLMCorrector (None if GROQ_API_KEY isn't set)
+    The client is thread-safe; one instance means one pool and one set of warm connections
+    """
+    if not GROQ_API_KEY:
+        return None
+    return Groq(api_key=GROQ_API_KEY, http_client=get_http_client(), max_retries=MAX_RETRIES)
+
+
+def new_async_http_client():
+    """
+    Async connection pool for an AsyncGroq client, with the same limits as get_http_client()
+    Not shared: an httpx.AsyncClient belongs to the event loop it is used on, so every
+    asyncio.run() batch creates its own (closing the AsyncGroq client closes it too)
+    """
+    return httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS, http2=_HTTP2)
+
+
+def stream_text(client, request):
+    """
+    Yield a chat completion's text as it is generated (stream=True)
+    Lets callers show or process the first tokens instead of waiting for the whole response
+    """
+    for chunk in client.chat.completions.create(stream=True, **request):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def run_batch(client, bodies, poll_interval=5.0, max_poll_interval=300.0):
+    """
+    Run chat completion requests through Groq's Batch API (async, discounted, 24h window)
+    Blocks until the job finishes, polling with exponential backoff
+    
+    Args:
+        client: Groq client
+        bodies: list of chat.completions request bodies (model, messages, ...)
+        
+    Returns:
+        list of response texts in input order (None where a request failed)
+    """
+    lines = [
+        json.dumps({"custom_id": f"req_{i}", "method": "POST", "url": "/v1/chat/completions", "body": body})
+        for i, body in enumerate(bodies)
+    ]
+    batch_file = client.files.create(file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    log.info(f"📦 Submitted batch {batch.id} ({len(bodies)} requests)")
+    
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
+        batch = client.batches.retrieve(batch.id)
+    
+    texts = [None] * len(bodies)
+    if not batch.output_file_id:
+        log.error(f"❌ Batch {batch.id} {batch.status} without output")
+        return texts
+    
+    for line in client.files.content(batch.output_file_id).read().decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") == 200:
+            idx = int(record["custom_id"].split("_")[1])
+            texts[idx] = response["body"]["choices"][0]["message"]["content"]
+    
+    log.info(f"✅ Batch {batch.id} {batch.status}: {sum(t is not None for t in texts)}/{len(bodies)} succeeded")
+    return texts
@@ -1,3 +1,4 @@
+import logging
 import os
 import sys
 from .preprocessing.image_processor import ImagePreprocessor
@@ -5,89 +6,98 @@ from .ocr.vision_ocr import VisionOCR
 from .postprocessing.llm_corrector import LLMCorrector
 from .document_generation.word_generator import WordGenerator
 
+log = logging.getLogger(__name__)
+
+
 class HandwritingToWordPipeline:
     """Main pipeline orchestrator"""
     
     def __init__(self, use_vision=True):
-        print("🚀 Initializing pipeline...")
-        self.preprocessor = ImagePreprocessor()
+        log.info("🚀 Initializing pipeline...")
         
         # Use Vision-based OCR for better accuracy
         if use_vision:
             self.ocr_engine = VisionOCR()
+            # Vision LLMs read the plain grayscale page best - no denoise/threshold
+            self.preprocessor = ImagePreprocessor(denoise_mode="none", binarize=False)
         else:
             from ocr.ocr_engine import OCREngine
             self.ocr_engine = OCREngine()
+            self.preprocessor = ImagePreprocessor(denoise_mode="nlm")
         
         self.llm_corrector = LLMCorrector()
         self.word_generator = WordGenerator()
-        print("✅ Pipeline ready!")
+        log.info("✅ Pipeline ready!")
     
     def process_image(self, image_path, output_name="converted_notes"):
         """
         Full pipeline: Image → OCR → LLM Correction → Word Doc
         """
-        print(f"\n{'='*60}")
-        print(f"📄 Processing: {image_path}")
-        print(f"{'='*60}\n")
+        log.info(f"\n{'='*60}")
+        log.info(f"📄 Processing: {image_path}")
+        log.info(f"{'='*60}\n")
         
-        # Step 1: Light preprocessing (just resize if needed)
-        print("STEP 1: Preprocessing...")
-        preprocessed_img, preprocessed_path = self.preprocessor.preprocess(image_path)
-        
-        # Step 2: Vision-based OCR (much better for handwriting)
-        print("\nSTEP 2: Running Vision OCR...")
+        # Step 1: Vision-based OCR (much better for handwriting)
+        log.info("\nSTEP 1: Running Vision OCR...")
         
         # Use original image for vision models (they handle preprocessing internally)
         ocr_result = self.ocr_engine.extract_text_from_image(image_path)
         
         if not ocr_result.get('text') or len(ocr_result['text']) < 50:
-            print("⚠️ OCR returned very little text, trying preprocessed image...")
+            log.warning("⚠️ OCR returned very little text, trying preprocessed image...")
+            # Light preprocessing (just resize if needed) - only run when the retry needs it
+            _, preprocessed_path = self.preprocessor.preprocess(image_path)
             ocr_result = self.ocr_engine.extract_text_from_image(preprocessed_path)
         
         extracted_text = ocr_result.get('text', '')
         confidence = ocr_result.get('confidence', 0)
         
-        print(f"\n📊 OCR Stats:")
-        print(f"   Confidence: {confidence:.2%}")
-        print(f"   Text length: {len(extracted_text)} characters")
-        print(f"   Preview:\n   {extracted_text[:200]}...")
+        log.info(f"\n📊 OCR Stats:")
+        log.info(f"   Confidence: {confidence:.2%}")
+        log.info(f"   Text length: {len(extracted_text)} characters")
+        log.info(f"   Preview:\n   {extracted_text[:200]}...")
         
         if len(extracted_text) < 20:
-            print("\n❌ ERROR: OCR failed to extract meaningful text!")
-            print("   Suggestions:")
-            print("   1. Check image quality")
-            print("   2. Ensure API keys are configured")
-            print("   3. Try different preprocessing settings")
+            log.error("\n❌ ERROR: OCR failed to extract meaningful text!")
+            log.info("   Suggestions:")
+            log.info("   1. Check image quality")
+            log.info("   2. Ensure API keys are configured")
+            log.info("   3. Try different preprocessing settings")
             return None
         
-        # Step 3: LLM correction (optional if Vision OCR is good)
-        print("\nSTEP 3: LLM post-processing...")
-        corrected_text = self.llm_corrector.correct_text(extracted_text)
-        structured_text = self.llm_corrector.structure_content(corrected_text)
+        # Step 2: LLM correction (optional if Vision OCR is good)
+        log.info("\nSTEP 2: LLM post-processing...")
+        structured_text = self.llm_corrector.correct_and_structure(extracted_text)
         
-        # Step 4: Generate Word document
-        print("\nSTEP 4: Generating Word document...")
+        # Step 3: Generate Word document
+        log.info("\nSTEP 3: Generating Word document...")
         output_path = self.word_generator.create_document(structured_text, output_name)
         
-        print(f"\n{'='*60}")
-        print(f"✅ SUCCESS! Document saved to: {output_path}")
-        print(f"{'='*60}\n")
+        log.info(f"\n{'='*60}")
+        log.info(f"✅ SUCCESS! Document saved to: {output_path}")
+        log.info(f"{'='*60}\n")
         
         return output_path
 
 
 def main():
+    # LOG_LEVEL=WARNING keeps only problems
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(message)s',
+        stream=sys.stdout
+    )
+    
     if len(sys.argv) < 2:
-        print("Usage: python main_pipeline.py <image_path> [output_name]")
-        print("Example: python main_pipeline.py uploads/notes1.jpg MyNotes")
+        log.error("Usage: python main_pipeline.py <image_path> [output_name]")
+        log.error("Example: python main_pipeline.py uploads/notes1.jpg MyNotes")
         sys.exit(1)
     
     image_path = sys.argv[1]
     output_name = sys.argv[2] if len(sys.argv) > 2 else "converted_notes"
     
     if not os.path.exists(image_path):
-        print(f"❌ Error: Image not found: {image_path}")
+        log.error(f"❌ Error: Image not found: {image_path}")
         sys.exit(1)
     
     # Run pipeline with Vision OCR
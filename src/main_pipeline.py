@@ -1,99 +1,144 @@
+import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from .preprocessing.image_processor import ImagePreprocessor
 from .preprocessing.diagram_detector import DiagramDetector
 from .ocr.hybrid_ocr import HybridOCR
 from .postprocessing.llm_corrector import LLMCorrector
 from .document_generation.word_generator import WordGenerator
 
+log = logging.getLogger(__name__)
+
+
+class _DeferredFlushHandler(logging.StreamHandler):
+    """
+    StreamHandler that leaves flushing to the stream's own buffering
+    stdout is line-buffered on a terminal, block-buffered when piped to a file
+    """
+    
+    def flush(self):
+        pass
+
+
 class HandwritingToWordPipeline:
     """Main pipeline orchestrator with diagram detection"""
     
-    def __init__(self, prefer_local=False, detect_diagrams=True):
+    def __init__(self, prefer_local=False, detect_diagrams=True, local_model="auto"):
         """
         Args:
             prefer_local: If True, skip API and use local model directly
             detect_diagrams: If True, detect and extract diagrams
+            local_model: "auto", "api", "florence", "got", or "easyocr"
         """
-        print("🚀 Initializing pipeline...")
-        print(f"   Mode: {'LOCAL-FIRST' if prefer_local else 'API-FIRST (with local fallback)'}")
-        print(f"   Diagram Detection: {'ENABLED' if detect_diagrams else 'DISABLED'}")
+        log.info("🚀 Initializing pipeline...")
+        log.info(f"   Mode: {'LOCAL-FIRST' if prefer_local else 'API-FIRST (with local fallback)'}")
+        log.info(f"   Diagram Detection: {'ENABLED' if detect_diagrams else 'DISABLED'}")
         
         self.preprocessor = ImagePreprocessor()
         self.diagram_detector = DiagramDetector() if detect_diagrams else None
-        self.ocr_engine = HybridOCR(prefer_local=prefer_local)
+        self.ocr_engine = HybridOCR(prefer_local=prefer_local, local_model=local_model)
         self.llm_corrector = LLMCorrector()
         self.word_generator = WordGenerator()
         
-        print("✅ Pipeline ready!")
+        log.info("✅ Pipeline ready!")
     
     def process_image(self, image_path, output_name="converted_notes"):
         """
         Full pipeline: Image → Diagram Detection → OCR → LLM Correction → Word Doc
         """
-        print(f"\n{'='*60}")
-        print(f"📄 Processing: {image_path}")
-        print(f"{'='*60}\n")
+        try:
+            return self._process_image(image_path, output_name)
+        finally:
+            # Per-image boundary: push out everything buffered for this image at once
+            sys.stdout.flush()
+    
+    def _process_image(self, image_path, output_name):
+        log.info(f"\n{'='*60}")
+        log.info(f"📄 Processing: {image_path}")
+        log.info(f"{'='*60}\n")
+        
+        # Step 1: Preprocessing - only needed as an OCR fallback, so it runs on first use
+        log.info("STEP 1: Preprocessing (deferred until OCR needs it)...")
+        
+        @lru_cache(maxsize=None)
+        def get_preprocessed_path():
+            # Keep only the on-disk copy - the decoded image is dropped straight away
+            _, preprocessed_path = self.preprocessor.preprocess(image_path)
+            return preprocessed_path
+        
+        def first_ocr_pass():
+            if self.ocr_engine.local_model == "florence":
+                # Florence reads both versions in one batched generate - keep the longer read
+                preprocessed_path = get_preprocessed_path()
+                results = self.ocr_engine.extract_text_batch([image_path, preprocessed_path])
+                return max(results, key=lambda r: len(r.get('text') or ''))
+            return self.ocr_engine.extract_text_from_image(image_path)
+        
+        # Steps 2 + 3: Diagram detection (optional) and the first OCR pass are independent,
+        # so both run on the original image at the same time
+        if self.diagram_detector:
+            log.info("\nSTEP 2: Detecting diagrams...")
+        log.info(f"\nSTEP {'3' if self.diagram_detector else '2'}: Running OCR...")
         
-        # Step 1: Preprocessing
-        print("STEP 1: Preprocessing...")
-        preprocessed_img, preprocessed_path = self.preprocessor.preprocess(image_path)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            diagram_future = executor.submit(self.diagram_detector.detect_and_extract, image_path) if self.diagram_detector else None
+            ocr_future = executor.submit(first_ocr_pass)
+            ocr_result = ocr_future.result()
+            diagram_info = diagram_future.result() if diagram_future else None
         
-        # Step 2: Diagram Detection (optional)
-        diagram_info = None
         text_only_path = image_path
-        
-        if self.diagram_detector:
-            print("\nSTEP 2: Detecting diagrams...")
-            diagram_info = self.diagram_detector.detect_and_extract(image_path)
-            
+        if diagram_info:
             if diagram_info.get('has_diagrams'):
                 diagrams = diagram_info.get('diagram_regions', [])
-                print(f"   ✅ Found {len(diagrams)} diagram(s)")
+                log.info(f"   ✅ Found {len(diagrams)} diagram(s)")
                 for i, diag in enumerate(diagrams):
-                    print(f"      Diagram {i+1}: {diag['path']}")
+                    log.info(f"      Diagram {i+1}: {diag['path']}")
                 
-                # Use text-only version for OCR
                 text_only_path = diagram_info.get('text_only_image', image_path)
             else:
-                print("   No diagrams detected")
-        
-        # Step 3: Hybrid OCR
-        print(f"\nSTEP {'3' if self.diagram_detector else '2'}: Running OCR...")
-        
-        # Try original/text-only image first
-        ocr_result = self.ocr_engine.extract_text_from_image(text_only_path)
-        
-        # If failed, try preprocessed
-        if not ocr_result.get('text') or len(ocr_result['text']) < 50:
-            print("  🔄 Retrying with preprocessed image...")
-            ocr_result = self.ocr_engine.extract_text_from_image(preprocessed_path)
+                log.info("   No diagrams detected")
+        
+        # If failed, retry on the text-only version (diagrams removed), then the preprocessed one.
+        # The vision API reads the original photo (VisionOCR only downscales it) - a
+        # thresholded copy doesn't help it, so API-only runs skip preprocessing entirely
+        retries = []
+        if text_only_path != image_path:
+            retries.append(("text-only", lambda: text_only_path))
+        # The Florence first pass already read the preprocessed image
+        if self.ocr_engine.local_model not in ("api", "florence"):
+            retries.append(("preprocessed", get_preprocessed_path))
+        for label, get_path in retries:
+            if ocr_result.get('text') and len(ocr_result['text']) >= 50:
+                break
+            log.info(f"  🔄 Retrying with {label} image...")
+            ocr_result = self.ocr_engine.extract_text_from_image(get_path())
         
         extracted_text = ocr_result.get('text', '')
         confidence = ocr_result.get('confidence', 0)
         method = ocr_result.get('method', 'unknown')
         
-        print(f"\n📊 OCR Results:")
-        print(f"   Method: {method}")
-        print(f"   Confidence: {confidence:.2%}")
-        print(f"   Text length: {len(extracted_text)} characters")
-        print(f"   Preview:\n   {extracted_text[:200]}...")
+        log.info(f"\n📊 OCR Results:")
+        log.info(f"   Method: {method}")
+        log.info(f"   Confidence: {confidence:.2%}")
+        log.info(f"   Text length: {len(extracted_text)} characters")
+        log.info(f"   Preview:\n   {extracted_text[:200]}...")
         
         if len(extracted_text) < 20:
-            print("\n❌ ERROR: OCR failed to extract meaningful text!")
-            print("   All methods failed. Please check:")
-            print("   1. Image quality and readability")
-            print("   2. API keys if using API mode")
-            print("   3. GPU availability for local model")
+            log.error("\n❌ ERROR: OCR failed to extract meaningful text!")
+            log.info("   All methods failed. Please check:")
+            log.info("   1. Image quality and readability")
+            log.info("   2. API keys if using API mode")
+            log.info("   3. GPU availability for local model")
             return None
         
         # Step 4: LLM post-processing
-        print(f"\nSTEP {'4' if self.diagram_detector else '3'}: LLM post-processing...")
-        corrected_text = self.llm_corrector.correct_text(extracted_text)
-        structured_text = self.llm_corrector.structure_content(corrected_text)
+        log.info(f"\nSTEP {'4' if self.diagram_detector else '3'}: LLM post-processing...")
+        structured_text = self.llm_corrector.correct_and_structure(extracted_text)
         
         # Step 5: Generate Word document
-        print(f"\nSTEP {'5' if self.diagram_detector else '4'}: Generating Word document...")
+        log.info(f"\nSTEP {'5' if self.diagram_detector else '4'}: Generating Word document...")
         
         # Pass diagrams to word generator if available
         diagrams_to_embed = None
@@ -106,12 +151,12 @@ class HandwritingToWordPipeline:
             diagrams=diagrams_to_embed
         )
         
-        print(f"\n{'='*60}")
-        print(f"✅ SUCCESS! Document saved to: {output_path}")
-        print(f"   OCR Method Used: {method}")
+        log.info(f"\n{'='*60}")
+        log.info(f"✅ SUCCESS! Document saved to: {output_path}")
+        log.info(f"   OCR Method Used: {method}")
         if diagram_info and diagram_info.get('has_diagrams'):
-            print(f"   Diagrams Detected: {len(diagram_info.get('diagram_regions', []))}")
-        print(f"{'='*60}\n")
+            log.info(f"   Diagrams Detected: {len(diagram_info.get('diagram_regions', []))}")
+        log.info(f"{'='*60}\n")
         
         return output_path
     
@@ -131,17 +176,28 @@ def main():
                        help='Use local model only (skip API)')
     parser.add_argument('--no-diagrams', action='store_true',
                        help='Disable diagram detection')
+    parser.add_argument('--model', default='auto',
+                       choices=['auto', 'api', 'florence', 'got', 'easyocr'],
+                       help='Force a specific OCR model (default: auto)')
     
     args = parser.parse_args()
     
+    # LOG_LEVEL=DEBUG adds OCR previews from the backends, WARNING keeps only problems
+    logging.basicConfig(
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        format='%(message)s',
+        handlers=[_DeferredFlushHandler(sys.stdout)]
+    )
+    
     if not os.path.exists(args.image_path):
-        print(f"❌ Error: Image not found: {args.image_path}")
+        log.error(f"❌ Error: Image not found: {args.image_path}")
         sys.exit(1)
     
     # Run pipeline
     pipeline = HandwritingToWordPipeline(
         prefer_local=args.local,
-        detect_diagrams=not args.no_diagrams
+        detect_diagrams=not args.no_diagrams,
+        local_model=args.model
     )
     
     try:
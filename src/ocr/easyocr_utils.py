@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+# Working resolution for EasyOCR (long side x short side): larger scans are shrunk
+# before detection instead of being decoded and upscaled/downscaled inside readtext()
+EASYOCR_LONG_SIDE = 1280
+EASYOCR_SHORT_SIDE = 960
+
+
+def load_for_easyocr(image):
+    """
+    Prepare an image for readtext(), shrinking it to EasyOCR's working resolution
+
+    Args:
+        image: File path or RGB ndarray
+
+    Returns:
+        (RGB ndarray no larger than the working resolution, scale applied)
+    """
+    if isinstance(image, str):
+        decoded = cv2.imread(image)
+        if decoded is None:
+            raise ValueError(f"Could not read image: {image}")
+        image = cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)
+
+    h, w = image.shape[:2]
+    scale = min(EASYOCR_LONG_SIDE / max(w, h), EASYOCR_SHORT_SIDE / min(w, h), 1.0)
+    if scale < 1.0:
+        image = cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    return image, scale
+
+
+def warm_up_easyocr(reader):
+    """
+    Run the detector once per page orientation, so CUDA/cuDNN initialization and
+    kernel loading happen at load time rather than on the first page
+    (load_for_easyocr() maps typical scans to these two shapes)
+    cuDNN autotuning is left off: it is process-wide, and the Florence-2 / GOT-OCR
+    inputs vary in shape, so they would pay for re-tuning
+    """
+    if getattr(reader, 'device', 'cpu') != 'cuda':
+        return
+
+    for shape in ((EASYOCR_SHORT_SIDE, EASYOCR_LONG_SIDE, 3), (EASYOCR_LONG_SIDE, EASYOCR_SHORT_SIDE, 3)):
+        reader.readtext(np.zeros(shape, dtype=np.uint8))
+
+
+def rescale_boxes(result, scale):
+    """Map readtext() boxes from a resized image back to original pixel coordinates"""
+    if scale == 1.0:
+        return result
+    inverse = 1.0 / scale
+    return [
+        ([[x * inverse, y * inverse] for x, y in bbox], text, conf)
+        for bbox, text, conf in result
+    ]
+
+
+def group_easyocr_lines(result, line_threshold=30):
+    """
+    Join EasyOCR readtext() boxes into text lines
+
+    Boxes are ordered top-to-bottom, left-to-right by their top-left corner. A box starts
+    a new line when it sits more than line_threshold pixels below the first box of the
+    current line; boxes on the same line are joined with spaces.
+
+    Args:
+        result: readtext(detail=1) output - list of (bbox, text, confidence)
+        line_threshold: Vertical distance in pixels that starts a new line
+
+    Returns:
+        Text with one line per row of boxes
+    """
+    if not result:
+        return ""
+
+    xs = np.fromiter((bbox[0][0] for bbox, _, _ in result), dtype=np.float64, count=len(result))
+    ys = np.fromiter((bbox[0][1] for bbox, _, _ in result), dtype=np.float64, count=len(result))
+    order = np.lexsort((xs, ys))
+    ys = ys[order]
+
+    # ys is sorted, so each line ends at the first box more than line_threshold below its start:
+    # one binary search per line instead of a Python branch per box
+    lines = []
+    start = 0
+    while start < len(ys):
+        end = int(np.searchsorted(ys, ys[start] + line_threshold, side='right'))
+        lines.append(' '.join(result[i][1] for i in order[start:end]))
+        start = end
+
+    return '\n'.join(lines)
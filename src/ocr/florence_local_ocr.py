@@ -1,7 +1,19 @@
+import logging
+import os
+from .torch_utils import GenerationGuard  # before torch: sets the CUDA allocator config
 import torch
 from PIL import Image
 from transformers import AutoProcessor, AutoModelForCausalLM
-import os
+import re
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# Upper bound on decode steps - generate stops at EOS, this only bounds runaway pages
+MAX_NEW_TOKENS = 1024
+
+# Quoted text labels inside OCR_WITH_REGION's structured output
+_LABEL_RE = re.compile(r"'([^']*)'")
 
 class FlorenceLocalOCR:
     """
@@ -9,14 +21,15 @@ class FlorenceLocalOCR:
     Runs on 6GB VRAM, excellent for handwritten documents
     """
     
-    def __init__(self, device=None):
+    def __init__(self, device=None, quantize=False):
         """
         Initialize Florence-2 model
         
         Args:
             device: 'cuda', 'cpu', or None (auto-detect)
+            quantize: If True, load int8 weights (bitsandbytes on GPU, dynamic quantization on CPU)
         """
-        print("🔧 Initializing Florence-2 Local OCR...")
+        log.info("🔧 Initializing Florence-2 Local OCR...")
         
         # Auto-detect device
         if device is None:
@@ -24,32 +37,88 @@ class FlorenceLocalOCR:
         else:
             self.device = device
         
-        print(f"   Device: {self.device}")
+        log.info(f"   Device: {self.device}")
+        
+        # Processor outputs per (task, file version) - a second task on the same page skips resize/normalize
+        self._processed_inputs = lru_cache(maxsize=32)(self._process_image)
+        
+        self._generation = GenerationGuard()
         
         try:
             # Load model and processor
             model_name = "microsoft/Florence-2-base"
             
-            print(f"   Loading {model_name}...")
+            log.info(f"   Loading {model_name}...")
             self.processor = AutoProcessor.from_pretrained(
                 model_name, 
                 trust_remote_code=True
             )
             
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                trust_remote_code=True,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
-            ).to(self.device)
+            quantization_config = self._int8_config() if quantize and self.device == "cuda" else None
+            
+            # bf16 keeps fp32's range at fp16's bandwidth; pre-Ampere cards fall back to fp16
+            if self.device == "cuda":
+                dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            else:
+                dtype = torch.float32
+            
+            if quantization_config:
+                # 8-bit weights are placed on the GPU at load time and can't be moved with .to()
+                self.model = self._load_model(
+                    model_name,
+                    torch_dtype=dtype,
+                    quantization_config=quantization_config,
+                    device_map=self.device
+                )
+                log.info("   Quantized: int8 (bitsandbytes)")
+            else:
+                self.model = self._load_model(model_name, torch_dtype=dtype).to(self.device)
+            
+            if quantize and self.device == "cpu":
+                self.model = torch.ao.quantization.quantize_dynamic(
+                    self.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+                log.info("   Quantized: int8 (dynamic, CPU)")
             
-            print("✅ Florence-2 loaded successfully")
+            # Compile the language-model forward pass that runs at every decode step
+            if self.device == "cuda" and self._generation.compile(self.model.language_model):
+                log.info("   Decoder compiled with torch.compile")
+            
+            log.info("✅ Florence-2 loaded successfully")
             self.available = True
             
         except Exception as e:
-            print(f"❌ Failed to load Florence-2: {e}")
-            print("   Will use fallback methods if called")
+            log.error(f"❌ Failed to load Florence-2: {e}")
+            log.info("   Will use fallback methods if called")
             self.available = False
     
+    def _load_model(self, model_name, **kwargs):
+        """Load Florence-2 with the fused SDPA attention kernel when the model code allows it"""
+        try:
+            return AutoModelForCausalLM.from_pretrained(
+                model_name,
+                trust_remote_code=True,
+                attn_implementation="sdpa",
+                **kwargs
+            )
+        except (ValueError, ImportError) as e:
+            log.warning(f"   ⚠️ SDPA attention unavailable, using default attention: {e}")
+            return AutoModelForCausalLM.from_pretrained(
+                model_name,
+                trust_remote_code=True,
+                **kwargs
+            )
+    
+    def _int8_config(self):
+        """BitsAndBytes 8-bit config, or None if bitsandbytes isn't installed"""
+        try:
+            import bitsandbytes  # noqa: F401
+            from transformers import BitsAndBytesConfig
+            return BitsAndBytesConfig(load_in_8bit=True)
+        except ImportError:
+            log.warning("   ⚠️ bitsandbytes not installed, loading unquantized weights")
+            return None
+    
     def extract_text_from_image(self, image_path):
         """
         Extract text from image using Florence-2
@@ -69,62 +138,18 @@ class FlorenceLocalOCR:
             }
         
         try:
-            # Load image
-            image = Image.open(image_path).convert('RGB')
-            
-            print(f"  🖼️  Processing with Florence-2...")
+            log.info(f"  🖼️  Processing with Florence-2...")
             
             # Task: OCR with region understanding
             # Florence-2 supports multiple tasks
             task_prompt = "<OCR_WITH_REGION>"
             
-            # Process image
-            inputs = self.processor(
-                text=task_prompt,
-                images=image,
-                return_tensors="pt"
-            )
-            
-            # Move to device and convert dtype appropriately
-            # input_ids must stay as Long, pixel_values should match model dtype
-            inputs = {
-                k: v.to(self.device).to(self.model.dtype) if k == "pixel_values" and isinstance(v, torch.Tensor)
-                else v.to(self.device) if isinstance(v, torch.Tensor)
-                else v
-                for k, v in inputs.items()
-            }
-            
-            # Generate
-            with torch.no_grad():
-                generated_ids = self.model.generate(
-                    input_ids=inputs["input_ids"],
-                    pixel_values=inputs["pixel_values"],
-                    max_new_tokens=2048,
-                    num_beams=3,
-                    do_sample=False
-                )
-            
-            # Decode
-            generated_text = self.processor.batch_decode(
-                generated_ids,
-                skip_special_tokens=True
-            )[0]
+            generated_text = self._generate([image_path], task_prompt)[0]
             
-            # Post-process Florence output
-            parsed_text = self._parse_florence_output(generated_text, task_prompt)
-            
-            print(f"  ✅ Florence-2 extracted {len(parsed_text)} characters")
-            print(f"     Preview: {parsed_text[:100]}...")
-            
-            return {
-                "text": parsed_text,
-                "confidence": 0.85,  # Florence is quite reliable
-                "method": "florence_local",
-                "raw_output": generated_text
-            }
+            return self._ocr_result(generated_text, task_prompt)
             
         except Exception as e:
-            print(f"  ❌ Florence-2 error: {e}")
+            log.error(f"  ❌ Florence-2 error: {e}")
             return {
                 "text": "",
                 "confidence": 0,
@@ -132,46 +157,149 @@ class FlorenceLocalOCR:
                 "method": "florence_local_error"
             }
     
-    def extract_with_detailed_caption(self, image_path):
+    def extract_text_batch(self, image_paths, batch_size=4):
+        """
+        Extract text from several images with batched generate calls
+        If a batch fails (e.g. out of memory) its pages are processed one by one
+        
+        Args:
+            image_paths: List of image file paths
+            batch_size: Pages per generate call (lower it if VRAM runs out)
+            
+        Returns:
+            list of dicts with 'text', 'confidence', 'method' (in input order)
+        """
+        if not self.available:
+            return [{
+                "text": "",
+                "confidence": 0,
+                "error": "Florence-2 model not available",
+                "method": "florence_local_failed"
+            } for _ in image_paths]
+        
+        task_prompt = "<OCR_WITH_REGION>"
+        results = []
+        for start in range(0, len(image_paths), batch_size):
+            chunk = image_paths[start:start + batch_size]
+            log.info(f"  🖼️  Processing {len(chunk)} images with Florence-2 (batched)...")
+            try:
+                generated_texts = self._generate(chunk, task_prompt)
+            except Exception as e:
+                log.warning(f"  ⚠️ Florence-2 batch failed, processing pages one by one: {e}")
+                if self.device == "cuda":
+                    torch.cuda.empty_cache()  # hand back what the failed batch allocated
+                results.extend(self.extract_text_from_image(path) for path in chunk)
+                continue
+            
+            results.extend(self._ocr_result(text, task_prompt) for text in generated_texts)
+        
+        return results
+    
+    def _load_image(self, image_path):
+        """
+        Open an image as RGB
+        Florence-2 works at 768x768, so JPEGs are decoded at reduced scale (no-op for PNG)
+        """
+        image = Image.open(image_path)
+        image.draft('RGB', (1024, 1024))
+        return image.convert('RGB')
+    
+    def _process_image(self, task_prompt, image_path, mtime, size):
+        """
+        Run the processor for one image (cached via self._processed_inputs)
+        mtime and size are only part of the cache key, so an overwritten file is re-read
+        
+        Returns:
+            (input_ids, pixel_values) CPU tensors with a batch dimension of 1
+        """
+        inputs = self.processor(
+            text=task_prompt,
+            images=self._load_image(image_path),
+            return_tensors="pt"
+        )
+        return inputs["input_ids"], inputs["pixel_values"]
+    
+    def _prepare_inputs(self, image_paths, task_prompt):
+        """Processor outputs for several images, stacked into one batch"""
+        batch = []
+        for path in image_paths:
+            stat = os.stat(path)
+            batch.append(self._processed_inputs(task_prompt, path, stat.st_mtime_ns, stat.st_size))
+        
+        # Florence resizes every image to the same resolution and the prompt is shared,
+        # so both tensors concatenate along the batch dimension
+        input_ids = torch.cat([ids for ids, _ in batch])
+        pixel_values = torch.cat([pixels for _, pixels in batch])
+        return input_ids, pixel_values
+    
+    def _generate(self, image_paths, task_prompt, max_new_tokens=MAX_NEW_TOKENS, beams=1):
+        """
+        Run Florence-2 generation for one or more images sharing a task prompt
+        Greedy by default - OCR output is near-deterministic, so beams rarely change it
+        
+        Returns:
+            list of decoded outputs, one per image
+        """
+        input_ids, pixel_values = self._prepare_inputs(image_paths, task_prompt)
+        
+        # Pinned host memory lets the non_blocking copies overlap with the rest of the setup
+        on_gpu = self.device == "cuda"
+        if on_gpu:
+            input_ids = input_ids.pin_memory()
+            pixel_values = pixel_values.pin_memory()
+        
+        # input_ids must stay as Long, pixel_values are cast to the model dtype in the same copy
+        input_ids = input_ids.to(self.device, non_blocking=on_gpu)
+        pixel_values = pixel_values.to(self.device, dtype=self.model.dtype, non_blocking=on_gpu)
+        
+        def generate():
+            with torch.inference_mode():
+                return self.model.generate(
+                    input_ids=input_ids,
+                    pixel_values=pixel_values,
+                    max_new_tokens=max_new_tokens,
+                    num_beams=beams,
+                    do_sample=False
+                )
+        
+        generated_ids = self._generation.run(generate)
+        
+        return self.processor.batch_decode(
+            generated_ids,
+            skip_special_tokens=True
+        )
+    
+    def _ocr_result(self, generated_text, task_prompt):
+        """Build the OCR result dict from raw Florence output"""
+        # Post-process Florence output
+        parsed_text = self._parse_florence_output(generated_text, task_prompt)
+        
+        log.info(f"  ✅ Florence-2 extracted {len(parsed_text)} characters")
+        log.debug(f"     Preview: {parsed_text[:100]}...")
+        
+        return {
+            "text": parsed_text,
+            "confidence": 0.85,  # Florence is quite reliable
+            "method": "florence_local",
+            "raw_output": generated_text
+        }
+    
+    def extract_with_detailed_caption(self, image_path, beams=1):
         """
         Alternative: Get detailed description (useful for diagrams)
+        
+        Args:
+            image_path: Path to image file
+            beams: Beam width (raise if caption quality suffers under greedy decoding)
         """
         if not self.available:
             return {"text": "", "confidence": 0}
         
         try:
-            image = Image.open(image_path).convert('RGB')
-            
             # Use detailed caption task
             task_prompt = "<MORE_DETAILED_CAPTION>"
             
-            inputs = self.processor(
-                text=task_prompt,
-                images=image,
-                return_tensors="pt"
-            )
-            
-            # Move to device and convert dtype appropriately
-            # input_ids must stay as Long, pixel_values should match model dtype
-            inputs = {
-                k: v.to(self.device).to(self.model.dtype) if k == "pixel_values" and isinstance(v, torch.Tensor)
-                else v.to(self.device) if isinstance(v, torch.Tensor)
-                else v
-                for k, v in inputs.items()
-            }
-            
-            with torch.no_grad():
-                generated_ids = self.model.generate(
-                    input_ids=inputs["input_ids"],
-                    pixel_values=inputs["pixel_values"],
-                    max_new_tokens=1024,
-                    num_beams=3
-                )
-            
-            generated_text = self.processor.batch_decode(
-                generated_ids,
-                skip_special_tokens=True
-            )[0]
+            generated_text = self._generate([image_path], task_prompt, beams=beams)[0]
             
             parsed = self._parse_florence_output(generated_text, task_prompt)
             
@@ -197,12 +325,8 @@ class FlorenceLocalOCR:
         try:
             # If it's structured output, extract text regions
             if "quad_boxes" in cleaned or "labels" in cleaned:
-                # Parse the labels (actual text)
-                import re
-                # Extract text between quotes in labels
-                texts = re.findall(r"'([^']*)'", cleaned)
-                if texts:
-                    return " ".join(texts)
+                # Parse the labels (actual text between quotes)
+                return " ".join(_LABEL_RE.findall(cleaned)) or cleaned
             
             # Otherwise return as-is
             return cleaned
@@ -215,6 +339,7 @@ class FlorenceLocalOCR:
         if self.available:
             del self.model
             del self.processor
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            print("✅ Florence-2 model unloaded")
\ No newline at end of file
+            self._processed_inputs.cache_clear()
+            # Freed blocks stay in PyTorch's caching allocator for the next model;
+            # HybridOCR.release_gpu_memory() hands them back to the driver if needed
+            log.info("✅ Florence-2 model unloaded")
\ No newline at end of file
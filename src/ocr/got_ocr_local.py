@@ -1,7 +1,46 @@
+import logging
+import os
+from .torch_utils import GenerationGuard  # before torch: sets the CUDA allocator config
 import torch
 from PIL import Image
 from transformers import AutoModel, AutoTokenizer
-import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# Chemistry/math symbols that suggest formula content, and a table that deletes them
+# (the count is the length difference - one C-level pass over the text)
+_SPECIAL_CHARS = '∆→≈≠±×÷∫∑'
+_DROP_SPECIAL = str.maketrans('', '', _SPECIAL_CHARS)
+
+# Default location of the exported vision encoder (see GOTOCRLocal.export_vision_encoder)
+VISION_ONNX_PATH = "cache/got_vision_encoder.onnx"
+
+# Generation cap for our own generate() calls (chat() hard-codes 4096); a dense
+# handwritten page is well under this, and it bounds runaway repetition
+MAX_NEW_TOKENS = 1024
+
+
+class _OnnxVisionEncoder(torch.nn.Module):
+    """
+    Drop-in replacement for GOT's ViT encoder backed by an ONNX Runtime session
+    GOT resizes every page to 1024x1024, so the exported graph has a static shape
+    """
+    
+    def __init__(self, session, fallback):
+        super().__init__()
+        self.session = session
+        self.fallback = fallback  # original torch encoder, used if the session fails
+    
+    def forward(self, pixel_values):
+        try:
+            features = self.session.run(None, {"pixel_values": pixel_values.float().cpu().numpy()})[0]
+        except Exception as e:
+            log.warning(f"  ⚠️ ONNX vision encoder failed, using PyTorch: {e}")
+            return self.fallback(pixel_values)
+        return torch.from_numpy(features).to(pixel_values.device, pixel_values.dtype)
+
 
 class GOTOCRLocal:
     """
@@ -9,14 +48,17 @@ class GOTOCRLocal:
     State-of-the-art model for document OCR with formulas and handwriting
     """
     
-    def __init__(self, device=None):
+    def __init__(self, device=None, quantize=False, vision_onnx=None):
         """
         Initialize GOT-OCR 2.0 model
         
         Args:
             device: 'cuda', 'cpu', or None (auto-detect)
+            quantize: If True, load int8 weights (bitsandbytes on GPU, dynamic quantization on CPU)
+            vision_onnx: Optional path of an ONNX vision encoder to run instead of PyTorch's
+                         (exported there first if the file doesn't exist)
         """
-        print("🔧 Initializing GOT-OCR 2.0...")
+        log.info("🔧 Initializing GOT-OCR 2.0...")
         
         # Auto-detect device
         if device is None:
@@ -24,13 +66,21 @@ class GOTOCRLocal:
         else:
             self.device = device
         
-        print(f"   Device: {self.device}")
+        log.info(f"   Device: {self.device}")
+        
+        # bf16 avoids fp16 overflow in softmax/layernorm; pre-Ampere cards stay on fp16
+        if self.device == "cuda":
+            self.dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        else:
+            self.dtype = torch.float32
+        
+        self._generation = GenerationGuard()
         
         try:
             # GOT-OCR 2.0 model
             model_name = "stepfun-ai/GOT-OCR2_0"
             
-            print(f"   Loading {model_name}...")
+            log.info(f"   Loading {model_name}...")
             
             # Load tokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(
@@ -38,40 +88,208 @@ class GOTOCRLocal:
                 trust_remote_code=True
             )
             
-            # Load model
-            self.model = AutoModel.from_pretrained(
-                model_name,
-                trust_remote_code=True,
-                low_cpu_mem_usage=True,
-                device_map=self.device if self.device == "cuda" else None,
-                use_safetensors=True,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+            quantization_config = self._int8_config() if quantize and self.device == "cuda" else None
+            
+            # Load model (int8 if requested, falling back to half precision if that fails)
+            self.model = None
+            if quantization_config:
+                try:
+                    self.model = self._load_model(model_name, quantization_config)
+                    log.info("   Quantized: int8 (bitsandbytes)")
+                except Exception as e:
+                    log.warning(f"   ⚠️ int8 load failed, loading unquantized weights: {e}")
+            
+            if self.model is None:
+                self.model = self._load_model(model_name)
             
             # Move to device if CPU
             if self.device == "cpu":
                 self.model = self.model.to(self.device)
+                if quantize:
+                    self.model = torch.ao.quantization.quantize_dynamic(
+                        self.model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                    log.info("   Quantized: int8 (dynamic, CPU)")
             
             # Set to eval mode
             self.model.eval()
             
-            print("✅ GOT-OCR 2.0 loaded successfully")
+            if self.device == "cuda":
+                # Compile the causal-LM forward pass that chat() runs at every decode step
+                if self._generation.compile(self.model):
+                    log.info("   Forward pass compiled with torch.compile")
+                # Side stream for uploading the next batch while the current one decodes
+                self._copy_stream = torch.cuda.Stream()
+            
+            log.info("✅ GOT-OCR 2.0 loaded successfully")
             self.available = True
             
+            # After available is set: the export needs the loaded model
+            if vision_onnx:
+                if not os.path.exists(vision_onnx):
+                    self.export_vision_encoder(vision_onnx)
+                self.use_onnx_vision(vision_onnx)
+            
         except Exception as e:
-            print(f"❌ Failed to load GOT-OCR 2.0: {e}")
-            print(f"   Error details: {str(e)}")
-            print("   Will use fallback methods if called")
+            log.error(f"❌ Failed to load GOT-OCR 2.0: {e}")
+            log.error(f"   Error details: {str(e)}")
+            log.info("   Will use fallback methods if called")
             self.available = False
     
-    def extract_text_from_image(self, image_path, ocr_type='ocr'):
+    def export_vision_encoder(self, onnx_path=VISION_ONNX_PATH):
+        """
+        Export the ViT vision encoder to ONNX (fp32, fixed 1x3x1024x1024 input)
+        Only the encoder is exported - the autoregressive decoder stays in PyTorch
+        
+        Returns:
+            onnx_path, or None if the export failed
+        """
+        if not self.available:
+            return None
+        
+        try:
+            import copy
+            # Export a float32 CPU copy so the loaded (half / int8) model is left untouched
+            encoder = copy.deepcopy(self.model.get_model().vision_tower_high).float().cpu().eval()
+            dummy = torch.zeros(1, 3, 1024, 1024)
+            
+            os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+            with torch.no_grad():
+                torch.onnx.export(
+                    encoder, dummy, onnx_path,
+                    input_names=["pixel_values"],
+                    output_names=["features"],
+                    opset_version=17
+                )
+            log.info(f"✅ Vision encoder exported: {onnx_path}")
+            return onnx_path
+            
+        except Exception as e:
+            log.error(f"❌ Vision encoder export failed: {e}")
+            return None
+    
+    def use_onnx_vision(self, onnx_path=VISION_ONNX_PATH):
+        """
+        Run the vision encoder through ONNX Runtime (TensorRT > CUDA > CPU provider)
+        Keeps the PyTorch encoder if onnxruntime or the exported file is unavailable
+        
+        Returns:
+            True if the ONNX encoder is now in use
+        """
+        try:
+            import onnxruntime as ort
+            
+            preferred = ("TensorrtExecutionProvider", "CUDAExecutionProvider", "CPUExecutionProvider")
+            available = ort.get_available_providers()
+            providers = [provider for provider in preferred if provider in available]
+            # TensorRT builds fp16 engines; its engine cache avoids rebuilding on every start
+            trt_options = {"trt_fp16_enable": True, "trt_engine_cache_enable": True,
+                           "trt_engine_cache_path": os.path.dirname(os.path.abspath(onnx_path))}
+            provider_options = [trt_options if provider == "TensorrtExecutionProvider" else {}
+                                for provider in providers]
+            
+            session = ort.InferenceSession(onnx_path, providers=providers, provider_options=provider_options)
+            
+            base = self.model.get_model()
+            encoder = base.vision_tower_high
+            if isinstance(encoder, _OnnxVisionEncoder):
+                encoder = encoder.fallback
+            base.vision_tower_high = _OnnxVisionEncoder(session, encoder)
+            
+            log.info(f"   Vision encoder: ONNX Runtime ({session.get_providers()[0]})")
+            return True
+            
+        except Exception as e:
+            log.warning(f"   ⚠️ ONNX vision encoder unavailable, using PyTorch: {e}")
+            return False
+    
+    def _load_model(self, model_name, quantization_config=None):
+        """Load GOT-OCR weights; quantized loads let bitsandbytes pick the compute dtype"""
+        kwargs = {}
+        if quantization_config:
+            kwargs["quantization_config"] = quantization_config
+        else:
+            kwargs["torch_dtype"] = self.dtype
+        
+        # Fused attention: FlashAttention-2 (half precision on CUDA only), else PyTorch SDPA,
+        # else whatever the remote model code supports
+        for attn_implementation in self._attention_candidates():
+            try:
+                return AutoModel.from_pretrained(
+                    model_name,
+                    trust_remote_code=True,
+                    low_cpu_mem_usage=True,
+                    device_map=self.device if self.device == "cuda" else None,
+                    use_safetensors=True,
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    attn_implementation=attn_implementation,
+                    **kwargs
+                )
+            except (ValueError, ImportError) as e:
+                log.warning(f"   ⚠️ {attn_implementation} attention unavailable: {e}")
+        
+        return AutoModel.from_pretrained(
+            model_name,
+            trust_remote_code=True,
+            low_cpu_mem_usage=True,
+            device_map=self.device if self.device == "cuda" else None,
+            use_safetensors=True,
+            pad_token_id=self.tokenizer.eos_token_id,
+            **kwargs
+        )
+    
+    def _attention_candidates(self):
+        """Attention kernels to try, fastest first"""
+        candidates = ["sdpa"]
+        if self.device == "cuda" and self.dtype in (torch.float16, torch.bfloat16):
+            try:
+                import flash_attn  # noqa: F401
+                candidates.insert(0, "flash_attention_2")
+            except ImportError:
+                pass
+        return candidates
+    
+    def _inference(self):
+        """inference_mode plus bf16 autocast on GPUs that support it"""
+        return torch.inference_mode(), torch.autocast(
+            "cuda", dtype=torch.bfloat16, enabled=self.dtype == torch.bfloat16
+        )
+    
+    def _chat(self, image_file, **kwargs):
+        """Run model.chat, dropping back to the eager forward if the compiled one fails"""
+        def chat():
+            inference_mode, autocast = self._inference()
+            with inference_mode, autocast:
+                return self.model.chat(self.tokenizer, image_file, **kwargs)
+        
+        return self._generation.run(chat)
+    
+    def _int8_config(self):
+        """
+        BitsAndBytes 8-bit config, or None if bitsandbytes isn't installed
+        Only the language model is quantized (W8A16); the vision encoder and its
+        projector stay in half precision, where int8 costs the most accuracy
+        """
+        try:
+            import bitsandbytes  # noqa: F401
+            from transformers import BitsAndBytesConfig
+            return BitsAndBytesConfig(
+                load_in_8bit=True,
+                llm_int8_threshold=6.0,
+                llm_int8_skip_modules=["vision_tower_high", "mm_projector_vary", "lm_head"]
+            )
+        except ImportError:
+            log.warning("   ⚠️ bitsandbytes not installed, loading unquantized weights")
+            return None
+    
+    def extract_text_from_image(self, image_path, ocr_type='ocr', image=None):
         """
         Extract text from image using GOT-OCR 2.0
         
         Args:
             image_path: Path to image file
             ocr_type: 'ocr' (plain text), 'format' (with formatting), or 'formula' (LaTeX formulas)
+            image: Optional already-decoded RGB PIL image of image_path (skips the decode)
             
         Returns:
             dict with 'text', 'confidence', 'method'
@@ -85,10 +303,11 @@ class GOTOCRLocal:
             }
         
         try:
-            # Load image
-            image = Image.open(image_path).convert('RGB')
+            # Load image (decoded once, handed to chat() instead of the path)
+            if image is None:
+                image = Image.open(image_path).convert('RGB')
             
-            print(f"  🖼️  Processing with GOT-OCR 2.0 ({ocr_type} mode)...")
+            log.info(f"  🖼️  Processing with GOT-OCR 2.0 ({ocr_type} mode)...")
             
             # GOT-OCR 2.0 supports different OCR modes
             # 'ocr' - plain OCR
@@ -96,19 +315,26 @@ class GOTOCRLocal:
             # 'formula' - Focus on mathematical formulas
             
             # For handwritten chemistry notes, use 'format' mode
-            with torch.no_grad():
-                # GOT-OCR uses chat method for inference
-                result = self.model.chat(
-                    self.tokenizer,
-                    image_path,
-                    ocr_type=ocr_type  # 'ocr', 'format', or 'formula'
-                )
+            if self.device == "cuda":
+                # Same prompt as chat() but with our own generate() call (capped output, KV cache)
+                try:
+                    result = self._generate_batch(*self._prepare_batch([image], ocr_type))[0]
+                except Exception as e:
+                    log.warning(f"  ⚠️ Direct generate failed, using chat(): {e}")
+                    result = None
+            else:
+                result = None
+            
+            if result is None:
+                # gradio_input=True makes chat() take the PIL image as-is
+                result = self._chat(image, ocr_type=ocr_type, gradio_input=True)  # 'ocr', 'format', or 'formula'
             
             # GOT-OCR returns plain text
             extracted_text = result.strip() if isinstance(result, str) else str(result)
             
-            print(f"  ✅ GOT-OCR extracted {len(extracted_text)} characters")
-            print(f"     Preview: {extracted_text[:100]}...")
+            log.info(f"  ✅ GOT-OCR extracted {len(extracted_text)} characters")
+            if extracted_text:
+                log.debug(f"     Preview: {extracted_text[:100]}...")
             
             # GOT-OCR doesn't provide confidence scores
             # Estimate based on output length and structure
@@ -122,7 +348,7 @@ class GOTOCRLocal:
             }
             
         except Exception as e:
-            print(f"  ❌ GOT-OCR error: {e}")
+            log.error(f"  ❌ GOT-OCR error: {e}")
             return {
                 "text": "",
                 "confidence": 0,
@@ -130,6 +356,125 @@ class GOTOCRLocal:
                 "method": "got_ocr_error"
             }
     
+    def extract_text_batch(self, image_paths, ocr_type='ocr', batch_size=4):
+        """
+        Extract text from several images with batched generate calls
+        model.chat() only takes one image, so this builds the same prompt and image
+        tensors itself; if that fails the pages go through chat() one by one
+        
+        Args:
+            image_paths: List of image file paths
+            ocr_type: 'ocr' or 'format' (same prompt for every page)
+            batch_size: Pages per generate call (lower it if VRAM runs out)
+            
+        Returns:
+            list of dicts with 'text', 'confidence', 'method' (in input order)
+        """
+        if not self.available or self.device != "cuda":
+            return [self.extract_text_from_image(path, ocr_type) for path in image_paths]
+        
+        chunks = [image_paths[start:start + batch_size] for start in range(0, len(image_paths), batch_size)]
+        results = []
+        
+        # The next chunk is decoded, preprocessed and copied to the GPU (on a side stream)
+        # while the current one is being generated, so only the first upload is exposed
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            pending = prefetch.submit(self._prepare_batch, chunks[0], ocr_type)
+            for idx, chunk in enumerate(chunks):
+                prepared = pending
+                if idx + 1 < len(chunks):
+                    pending = prefetch.submit(self._prepare_batch, chunks[idx + 1], ocr_type)
+                
+                log.info(f"  🖼️  Processing {len(chunk)} images with GOT-OCR 2.0 (batched, {ocr_type} mode)...")
+                try:
+                    texts = self._generate_batch(*prepared.result())
+                except Exception as e:
+                    log.warning(f"  ⚠️ GOT-OCR batch failed, processing pages one by one: {e}")
+                    results.extend(self.extract_text_from_image(path, ocr_type) for path in chunk)
+                    continue
+                
+                for text in texts:
+                    results.append({
+                        "text": text,
+                        "confidence": self._estimate_confidence(text),
+                        "method": "got_ocr_local",
+                        "ocr_type": ocr_type
+                    })
+        
+        return results
+    
+    def _prepare_batch(self, images, ocr_type):
+        """
+        Build the chat() prompt and image tensors for a batch and start their upload
+        images may be file paths or already-decoded RGB PIL images
+        
+        Returns:
+            (input_ids, images, stop_str, ready) where ready is a CUDA event recorded
+            after the host-to-device copies on the side stream
+        """
+        # Prompt template, image processor and special tokens live in GOT's remote code module
+        got = sys.modules[type(self.model).__module__]
+        image_processor = got.GOTImageEvalProcessor(image_size=1024)
+        
+        query = 'OCR with format: ' if ocr_type == 'format' else 'OCR: '
+        query = (got.DEFAULT_IM_START_TOKEN + got.DEFAULT_IMAGE_PATCH_TOKEN * 256
+                 + got.DEFAULT_IM_END_TOKEN + '\n' + query)
+        conv = got.conv_mpt.copy()
+        conv.append_message(conv.roles[0], query)
+        conv.append_message(conv.roles[1], None)
+        
+        # Every page shares the prompt, so the ids stack without padding
+        prompt_ids = self.tokenizer([conv.get_prompt()]).input_ids
+        host_ids = torch.as_tensor(prompt_ids * len(images)).pin_memory()
+        host_images = [
+            image_processor(image if isinstance(image, Image.Image) else Image.open(image).convert('RGB'))
+            .unsqueeze(0).pin_memory()
+            for image in images
+        ]
+        
+        with torch.cuda.stream(self._copy_stream):
+            input_ids = host_ids.to(self.device, non_blocking=True)
+            images = [image.to(self.device, dtype=self.dtype, non_blocking=True) for image in host_images]
+        ready = torch.cuda.Event()
+        ready.record(self._copy_stream)
+        
+        return input_ids, images, conv.sep, ready
+    
+    def _generate_batch(self, input_ids, images, stop_str, ready, max_new_tokens=MAX_NEW_TOKENS):
+        """Batched equivalent of model.chat() for plain/format OCR"""
+        # Wait for this batch's upload only, then hand its tensors to the compute stream
+        compute_stream = torch.cuda.current_stream()
+        compute_stream.wait_event(ready)
+        for tensor in (input_ids, *images):
+            tensor.record_stream(compute_stream)
+        
+        def generate():
+            inference_mode, autocast = self._inference()
+            with inference_mode, autocast:
+                return self.model.generate(
+                    input_ids,
+                    images=images,
+                    do_sample=False,
+                    num_beams=1,
+                    no_repeat_ngram_size=20,
+                    max_new_tokens=max_new_tokens,
+                    use_cache=True,
+                    # Pages finish independently on the turn separator (chat() uses a stopping criterion)
+                    eos_token_id=[self.tokenizer.convert_tokens_to_ids(stop_str), self.tokenizer.eos_token_id],
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+        
+        # Same eager fallback as chat(): every CUDA page goes through here
+        output_ids = self._generation.run(generate)
+        
+        texts = []
+        for row in output_ids[:, input_ids.shape[1]:]:
+            text = self.tokenizer.decode(row, skip_special_tokens=True).strip()
+            if text.endswith(stop_str):
+                text = text[:-len(stop_str)].strip()
+            texts.append(text)
+        return texts
+    
     def extract_with_box_detection(self, image_path):
         """
         Extract text with bounding box detection
@@ -139,16 +484,11 @@ class GOTOCRLocal:
             return {"text": "", "confidence": 0}
         
         try:
-            print(f"  🔍 Processing with box detection...")
+            log.info(f"  🔍 Processing with box detection...")
             
-            with torch.no_grad():
-                # Use 'format' mode for better structure preservation
-                result = self.model.chat(
-                    self.tokenizer,
-                    image_path,
-                    ocr_type='format',
-                    ocr_box=''  # Empty string enables box detection
-                )
+            # Use 'format' mode for better structure preservation
+            # (empty ocr_box enables box detection)
+            result = self._chat(image_path, ocr_type='format', ocr_box='')
             
             extracted_text = result.strip() if isinstance(result, str) else str(result)
             confidence = self._estimate_confidence(extracted_text)
@@ -160,7 +500,7 @@ class GOTOCRLocal:
             }
             
         except Exception as e:
-            print(f"  ❌ Box detection error: {e}")
+            log.error(f"  ❌ Box detection error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
     def extract_formulas(self, image_path):
@@ -172,14 +512,9 @@ class GOTOCRLocal:
             return {"text": "", "confidence": 0}
         
         try:
-            print(f"  🧮 Extracting formulas...")
+            log.info(f"  🧮 Extracting formulas...")
             
-            with torch.no_grad():
-                result = self.model.chat(
-                    self.tokenizer,
-                    image_path,
-                    ocr_type='formula'  # Formula mode for LaTeX
-                )
+            result = self._chat(image_path, ocr_type='formula')  # Formula mode for LaTeX
             
             extracted_text = result.strip() if isinstance(result, str) else str(result)
             confidence = self._estimate_confidence(extracted_text)
@@ -192,7 +527,7 @@ class GOTOCRLocal:
             }
             
         except Exception as e:
-            print(f"  ❌ Formula extraction error: {e}")
+            log.error(f"  ❌ Formula extraction error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
     def _estimate_confidence(self, text):
@@ -200,20 +535,19 @@ class GOTOCRLocal:
         Estimate confidence based on output characteristics
         GOT-OCR doesn't provide confidence scores, so we estimate
         """
-        if not text:
+        # Empty / near-empty output is never usable (callers need > 50 chars) - skip the scoring
+        if len(text) < 10:
             return 0.0
         
         # Base confidence
         confidence = 0.85
         
-        # Adjust based on text length (very short = suspicious)
-        if len(text) < 10:
-            confidence -= 0.3
-        elif len(text) < 50:
+        # Adjust based on text length (short = suspicious)
+        if len(text) < 50:
             confidence -= 0.1
         
         # Adjust based on special characters (formulas, etc.)
-        special_chars = sum(1 for c in text if c in '∆→≈≠±×÷∫∑')
+        special_chars = len(text) - len(text.translate(_DROP_SPECIAL))
         if special_chars > 5:
             confidence += 0.05  # Likely chemistry/math content
         
@@ -225,6 +559,6 @@ class GOTOCRLocal:
         if self.available:
             del self.model
             del self.tokenizer
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            print("✅ GOT-OCR 2.0 model unloaded")
\ No newline at end of file
+            # Freed blocks stay in PyTorch's caching allocator for the next model;
+            # HybridOCR.release_gpu_memory() hands them back to the driver if needed
+            log.info("✅ GOT-OCR 2.0 model unloaded")
\ No newline at end of file
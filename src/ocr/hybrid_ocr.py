@@ -1,7 +1,112 @@
-import os
-from dotenv import load_dotenv
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# Backends and their heavy dependencies (torch, transformers, groq, cv2) are imported
+# on first use, so constructing HybridOCR stays cheap whichever backend ends up running
+
+# Loaded backends are process-wide singletons shared by every HybridOCR instance, so
+# several instances (per thread, per document) hold one copy of each model.
+# The lock keeps two threads from loading the same model at once.
+_load_lock = threading.Lock()
+_loaded = {}  # display name -> backend instance, for release_all()
+
+# Backends still worth trying on a page a batched local backend read poorly, in order
+# (a forced "api" run keeps the API's result, as it does for a single page)
+_BATCH_FALLBACKS = {
+    "florence": ("got", "easyocr"),
+    "got": ("easyocr",),
+}
+
+
+def _unload(backend):
+    """
+    cleanup() a local model (Florence-2 / GOT-OCR) and mark it unavailable, so an
+    instance still holding it gets "model not available" instead of a deleted model
+    """
+    with backend._generation.lock:  # let an in-flight generate finish first
+        backend.cleanup()
+        backend.available = False
+
+
+def _release_stale(name):
+    """
+    Unload a model loaded with other settings (e.g. quantize toggled) before its
+    replacement loads - instances built for the old settings still reference it,
+    so it would otherwise stay on the GPU alongside the new one
+    """
+    stale = _loaded.pop(name, None)
+    if not getattr(stale, 'available', False):
+        return
+    _unload(stale)
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    log.info(f"  ♻️  Released previous {name} model")
+
+
+# lru_cache(maxsize=1): a call with different arguments is a cache miss, which
+# replaces the loaded model rather than loading a second copy
+@lru_cache(maxsize=1)
+def _get_florence(quantize=False):
+    _release_stale("Florence-2")
+    log.info("  📥 Loading Florence-2 model...")
+    from .florence_local_ocr import FlorenceLocalOCR
+    _loaded["Florence-2"] = FlorenceLocalOCR(quantize=quantize)
+    return _loaded["Florence-2"]
+
+
+@lru_cache(maxsize=1)
+def _get_got(quantize=False):
+    _release_stale("GOT-OCR 2.0")
+    log.info("  📥 Loading GOT-OCR 2.0 model...")
+    from ..config import GOT_VISION_ONNX
+    from .got_ocr_local import GOTOCRLocal
+    _loaded["GOT-OCR 2.0"] = GOTOCRLocal(quantize=quantize, vision_onnx=GOT_VISION_ONNX)
+    return _loaded["GOT-OCR 2.0"]
+
+
+@lru_cache(maxsize=1)
+def _get_easy_reader(lang='en', gpu=True):
+    log.info("  📥 Loading EasyOCR...")
+    import easyocr
+    from .easyocr_utils import warm_up_easyocr
+    reader = easyocr.Reader([lang], gpu=gpu, verbose=False)
+    warm_up_easyocr(reader)
+    _loaded["EasyOCR"] = reader
+    return reader
+
+
+@lru_cache(maxsize=1)
+def _get_vision():
+    from .vision_ocr import VisionOCR
+    _loaded["Llama Vision"] = VisionOCR()
+    return _loaded["Llama Vision"]
+
+
+def release_all():
+    """
+    Unload every shared backend (e.g. at teardown); the next use loads them again
+    
+    Returns:
+        list of the backend names that were released
+    """
+    with _load_lock:
+        released = list(_loaded)
+        for backend in _loaded.values():
+            if getattr(backend, 'available', False):
+                try:
+                    _unload(backend)
+                except:
+                    pass
+        _loaded.clear()
+        for getter in (_get_florence, _get_got, _get_easy_reader, _get_vision):
+            getter.cache_clear()
+    return released
 
-load_dotenv()
 
 class HybridOCR:
     """
@@ -12,40 +117,40 @@ class HybridOCR:
     4. EasyOCR Fallback
     """
     
-    def __init__(self, prefer_local=False, local_model="auto"):
+    def __init__(self, prefer_local=False, local_model="auto", quantize=False):
         """
         Args:
             prefer_local: If True, skip API and use local model
             local_model: "auto", "florence", "got", or "easyocr"
+            quantize: If True, load Florence-2 / GOT-OCR with int8 weights
         """
         self.prefer_local = prefer_local
         self.local_model = local_model
+        self.quantize = quantize
         
-        print(f"🔧 Initializing Hybrid OCR...")
-        print(f"   Mode: {'LOCAL' if prefer_local else 'API-FIRST'}")
-        print(f"   Local Model: {local_model}")
+        log.info(f"🔧 Initializing Hybrid OCR...")
+        log.info(f"   Mode: {'LOCAL' if prefer_local else 'API-FIRST'}")
+        log.info(f"   Local Model: {local_model}")
+        if quantize:
+            log.info("   Quantization: int8")
         
-        # Initialize API OCR
+        # API OCR is enabled when a key is configured; the client is created on first use
         self.api_ocr = None
+        self.api_enabled = False
         if not prefer_local:
-            try:
-                from .vision_ocr import VisionOCR
-                groq_key = os.getenv('GROQ_API_KEY')
-                if groq_key:
-                    self.api_ocr = VisionOCR()
-                    print("✅ API OCR available (Llama Vision)")
-                else:
-                    print("⚠️  No Groq API key found")
-            except Exception as e:
-                print(f"⚠️  API OCR unavailable: {e}")
+            from ..config import GROQ_API_KEY
+            if GROQ_API_KEY:
+                self.api_enabled = True
+                log.info("✅ API OCR enabled (Llama Vision)")
+            else:
+                log.warning("⚠️  No Groq API key found")
         
-        # Lazy loading for local models (only load when needed)
+        # Lazy loading for local models (only load when needed, shared across instances)
         self.florence_ocr = None
         self.got_ocr = None
-        self.easy_ocr = None
         self.easy_reader = None
         
-        print("✅ Hybrid OCR initialized (local models will load on demand)")
+        log.info("✅ Hybrid OCR initialized (local models will load on demand)")
     
     def extract_text_from_image(self, image_path):
         """
@@ -56,10 +161,19 @@ class HybridOCR:
         """
         result = None
         
+        # GOT-OCR and EasyOCR share one decode of the page (Florence and the API read the file)
+        @lru_cache(maxsize=None)
+        def decoded():
+            try:
+                from PIL import Image
+                return Image.open(image_path).convert('RGB')
+            except Exception:
+                return None  # backends fall back to the path and report the error themselves
+        
         # Force specific model if requested during init
         if self.local_model == "api":
-            if not self.api_ocr:
-                print("  ⚠️  API OCR not available, falling back...")
+            if not self.api_enabled or self._load_api():
+                log.warning("  ⚠️  API OCR not available, falling back...")
             else:
                 return self._try_api_ocr(image_path)
         
@@ -67,40 +181,48 @@ class HybridOCR:
             result = self._try_florence(image_path)
             if self._is_good_result(result):
                 return result
-            print("  ⚠️  Florence failed, trying fallback...")
+            log.warning("  ⚠️  Florence failed, trying fallback...")
         
         elif self.local_model == "got":
-            result = self._try_got_ocr(image_path)
+            result = self._try_got_ocr(image_path, decoded())
             if self._is_good_result(result):
                 return result
-            print("  ⚠️  GOT-OCR failed, trying fallback...")
+            log.warning("  ⚠️  GOT-OCR failed, trying fallback...")
         
         elif self.local_model == "easyocr":
-            return self._try_easyocr(image_path)
+            return self._try_easyocr(image_path, decoded())
         
         # Auto mode: try in priority order
-        if not self.prefer_local and self.api_ocr:
-            result = self._try_api_ocr(image_path)
+        florence_tried = False
+        if not self.prefer_local and self.api_enabled:
+            if self._local_gpu_available():
+                # Network-bound API and GPU-bound Florence don't contend - take whichever
+                # returns a good read first instead of waiting out the API before starting
+                result = self._race_api_and_florence(image_path)
+                florence_tried = True
+            else:
+                result = self._try_api_ocr(image_path)
             if self._is_good_result(result):
                 return result
         
         # Try Florence
-        result = self._try_florence(image_path)
-        if self._is_good_result(result):
-            return result
+        if not florence_tried:
+            result = self._try_florence(image_path)
+            if self._is_good_result(result):
+                return result
         
         # Try GOT-OCR
-        result = self._try_got_ocr(image_path)
+        result = self._try_got_ocr(image_path, decoded())
         if self._is_good_result(result):
             return result
         
         # Last resort: EasyOCR
-        result = self._try_easyocr(image_path)
+        result = self._try_easyocr(image_path, decoded())
         if self._is_good_result(result):
             return result
         
         # All failed
-        print("  ❌ All OCR methods failed!")
+        log.error("  ❌ All OCR methods failed!")
         return {
             "text": "",
             "confidence": 0,
@@ -108,100 +230,252 @@ class HybridOCR:
             "method": "all_failed"
         }
     
+    def _local_gpu_available(self):
+        """True if local models would run on a GPU (checked once, imports torch on first call)"""
+        if not hasattr(self, '_has_gpu'):
+            try:
+                import torch
+                self._has_gpu = torch.cuda.is_available()
+            except ImportError:
+                self._has_gpu = False
+        return self._has_gpu
+    
+    def _race_api_and_florence(self, image_path):
+        """
+        Run the API and Florence-2 concurrently and return the first good result
+        If neither is good, the longer of the two is returned
+        """
+        executor = ThreadPoolExecutor(max_workers=2)
+        futures = [
+            executor.submit(self._try_api_ocr, image_path),
+            executor.submit(self._try_florence, image_path),
+        ]
+        try:
+            results = []
+            for future in as_completed(futures):
+                result = future.result()
+                if self._is_good_result(result):
+                    return result
+                results.append(result)
+            return max(results, key=lambda r: len(r.get('text') or ''))
+        finally:
+            # Don't wait for the slower backend - its result is no longer needed
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+    
+    def _load_api(self):
+        """Lazy create the Llama Vision client. Returns an error string if that failed."""
+        with _load_lock:
+            if not self.api_ocr:
+                try:
+                    self.api_ocr = _get_vision()
+                except Exception as e:
+                    log.warning(f"⚠️  API OCR unavailable: {e}")
+                    self.api_enabled = False
+                    return str(e)
+        return None
+    
     def _try_api_ocr(self, image_path):
-        """Try Llama Vision API"""
-        print("  📡 Trying Llama Vision API...")
+        """Try Llama Vision API (lazy load)"""
+        error = self._load_api()
+        if error:
+            return {"text": "", "confidence": 0, "error": error}
+        
+        log.info("  📡 Trying Llama Vision API...")
         try:
             result = self.api_ocr.extract_text_from_image(image_path)
             if result.get('text'):
-                print(f"  ✅ API OCR succeeded")
+                log.info(f"  ✅ API OCR succeeded")
             return result
         except Exception as e:
-            print(f"  ❌ API OCR error: {e}")
+            log.error(f"  ❌ API OCR error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
-    def _try_florence(self, image_path):
-        """Try Florence-2 (lazy load)"""
-        if not self.florence_ocr:
-            print("  📥 Loading Florence-2 model...")
+    def extract_text_batch(self, image_paths, mode="realtime"):
+        """
+        Extract text from several pages, batching local GPU inference where the model allows
+        (and keeping API requests in flight concurrently)
+        Pages a local batch read poorly go through the backends the batch didn't use
+        
+        Args:
+            image_paths: List of image file paths
+            mode: "realtime", or "batch" to send API pages through Groq's Batch API
+                  (half the cost, results within 24h - for bulk/background jobs)
+        
+        Returns:
+            list of dicts with 'text', 'confidence', 'method' (in page order)
+        """
+        if self.local_model not in ("api", "florence", "got") or len(image_paths) < 2:
+            return [self.extract_text_from_image(path) for path in image_paths]
+        
+        if self.local_model == "api":
+            if not self.api_enabled or self._load_api():
+                # Same as a single page: without the API every page takes the auto chain
+                log.warning("  ⚠️  API OCR not available, falling back...")
+                return [self.extract_text_from_image(path) for path in image_paths]
+            return self._try_api_batch(image_paths, offline=mode == "batch")
+        
+        if self.local_model == "florence":
+            results = self._try_florence_batch(image_paths)
+        else:
+            results = self._try_got_batch(image_paths)
+        return [
+            result if self._is_good_result(result) else self._fallback_after_batch(path)
+            for path, result in zip(image_paths, results)
+        ]
+    
+    def _fallback_after_batch(self, image_path):
+        """
+        Read a page the batch couldn't, using only the backends the batch didn't run
+        (decoding is greedy, so the same backend would return the same weak result)
+        """
+        log.warning(f"  ⚠️  {self.local_model} batch result too weak, trying fallback...")
+        
+        @lru_cache(maxsize=None)
+        def decoded():
             try:
-                from .florence_local_ocr import FlorenceLocalOCR
-                self.florence_ocr = FlorenceLocalOCR()
+                from PIL import Image
+                return Image.open(image_path).convert('RGB')
+            except Exception:
+                return None
+        
+        attempts = {
+            "florence": lambda: self._try_florence(image_path),
+            "got": lambda: self._try_got_ocr(image_path, decoded()),
+            "easyocr": lambda: self._try_easyocr(image_path, decoded()),
+        }
+        for name in _BATCH_FALLBACKS[self.local_model]:
+            result = attempts[name]()
+            if self._is_good_result(result):
+                return result
+        
+        log.error("  ❌ All OCR methods failed!")
+        return {
+            "text": "",
+            "confidence": 0,
+            "error": "All OCR methods failed",
+            "method": "all_failed"
+        }
+    
+    def _try_api_batch(self, image_paths, offline=False):
+        """Try Llama Vision API on all pages concurrently (or as one offline batch job)"""
+        error = "API OCR not enabled" if not self.api_enabled else self._load_api()
+        if error:
+            return [{"text": "", "confidence": 0, "error": error} for _ in image_paths]
+        
+        log.info(f"  📡 Trying Llama Vision API on {len(image_paths)} pages...")
+        if offline:
+            return self.api_ocr.extract_batch_offline(image_paths)
+        return self.api_ocr.extract_batch(image_paths)
+    
+    def _load_florence(self):
+        """Lazy load Florence-2. Returns an error string if loading failed."""
+        # Always ask the (cached) getter: if the model this instance held was released
+        # (quantize toggled by another instance, release_all) it loads the current one
+        with _load_lock:
+            try:
+                self.florence_ocr = _get_florence(self.quantize)
             except Exception as e:
-                print(f"  ❌ Failed to load Florence-2: {e}")
-                return {"text": "", "confidence": 0, "error": str(e)}
+                log.error(f"  ❌ Failed to load Florence-2: {e}")
+                return str(e)
+        return None
+    
+    def _try_florence_batch(self, image_paths):
+        """Try Florence-2 on all pages in batched generate calls"""
+        error = self._load_florence()
+        if error:
+            return [{"text": "", "confidence": 0, "error": error} for _ in image_paths]
+        
+        log.info(f"  🖥️  Trying Florence-2 on {len(image_paths)} pages...")
+        return self.florence_ocr.extract_text_batch(image_paths)
+    
+    def _try_florence(self, image_path):
+        """Try Florence-2 (lazy load)"""
+        error = self._load_florence()
+        if error:
+            return {"text": "", "confidence": 0, "error": error}
         
-        print("  🖥️  Trying Florence-2...")
+        log.info("  🖥️  Trying Florence-2...")
         try:
             result = self.florence_ocr.extract_text_from_image(image_path)
             if result.get('text'):
-                print(f"  ✅ Florence-2 succeeded")
+                log.info(f"  ✅ Florence-2 succeeded")
             return result
         except Exception as e:
-            print(f"  ❌ Florence-2 error: {e}")
+            log.error(f"  ❌ Florence-2 error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
-    def _try_got_ocr(self, image_path):
-        """Try GOT-OCR 2.0 (lazy load)"""
-        if not self.got_ocr:
-            print("  📥 Loading GOT-OCR 2.0 model...")
+    def _load_got(self):
+        """Lazy load GOT-OCR 2.0. Returns an error string if loading failed."""
+        # Always ask the (cached) getter: if the model this instance held was released
+        # (quantize toggled by another instance, release_all) it loads the current one
+        with _load_lock:
             try:
-                from .got_ocr_local import GOTOCRLocal
-                self.got_ocr = GOTOCRLocal()
+                self.got_ocr = _get_got(self.quantize)
             except Exception as e:
-                print(f"  ❌ Failed to load GOT-OCR 2.0: {e}")
-                return {"text": "", "confidence": 0, "error": str(e)}
+                log.error(f"  ❌ Failed to load GOT-OCR 2.0: {e}")
+                return str(e)
+        return None
+    
+    def _try_got_batch(self, image_paths):
+        """Try GOT-OCR 2.0 on all pages in batched generate calls"""
+        error = self._load_got()
+        if error:
+            return [{"text": "", "confidence": 0, "error": error} for _ in image_paths]
         
-        print("  🖥️  Trying GOT-OCR 2.0...")
+        log.info(f"  🖥️  Trying GOT-OCR 2.0 on {len(image_paths)} pages...")
+        return self.got_ocr.extract_text_batch(image_paths, ocr_type='format')
+    
+    def _try_got_ocr(self, image_path, image=None):
+        """Try GOT-OCR 2.0 (lazy load)"""
+        error = self._load_got()
+        if error:
+            return {"text": "", "confidence": 0, "error": error}
+        
+        log.info("  🖥️  Trying GOT-OCR 2.0...")
         try:
-            result = self.got_ocr.extract_text_from_image(image_path, ocr_type='format')
+            result = self.got_ocr.extract_text_from_image(image_path, ocr_type='format', image=image)
             if result.get('text'):
-                print(f"  ✅ GOT-OCR succeeded")
+                log.info(f"  ✅ GOT-OCR succeeded")
             return result
         except Exception as e:
-            print(f"  ❌ GOT-OCR error: {e}")
+            log.error(f"  ❌ GOT-OCR error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
-    def _try_easyocr(self, image_path):
+    def _load_easyocr(self):
+        """Lazy load EasyOCR. Returns an error string if loading failed."""
+        with _load_lock:
+            if not self.easy_reader:
+                try:
+                    self.easy_reader = _get_easy_reader()
+                except Exception as e:
+                    log.error(f"  ❌ Failed to load EasyOCR: {e}")
+                    return str(e)
+        return None
+    
+    def _try_easyocr(self, image_path, image=None):
         """Try EasyOCR (lazy load)"""
-        if not self.easy_reader:
-            print("  📥 Loading EasyOCR...")
-            try:
-                import easyocr
-                self.easy_reader = easyocr.Reader(['en'], gpu=True, verbose=False)
-                self.easy_ocr = True
-            except Exception as e:
-                print(f"  ❌ Failed to load EasyOCR: {e}")
-                return {"text": "", "confidence": 0, "error": str(e)}
+        error = self._load_easyocr()
+        if error:
+            return {"text": "", "confidence": 0, "error": error}
         
-        print("  🔄 Trying EasyOCR...")
+        log.info("  🔄 Trying EasyOCR...")
         try:
-            result = self.easy_reader.readtext(image_path, detail=1, paragraph=False)
+            import numpy as np
+            from .easyocr_utils import group_easyocr_lines, load_for_easyocr, rescale_boxes
+            
+            source = np.asarray(image) if image is not None else image_path
+            resized, scale = load_for_easyocr(source)
+            result = rescale_boxes(self.easy_reader.readtext(resized, detail=1, paragraph=False), scale)
             
             if not result:
                 return {"text": "", "confidence": 0}
             
-            result_sorted = sorted(result, key=lambda x: (x[0][0][1], x[0][0][0]))
-            
-            lines = []
-            current_y = -1
-            
-            for (bbox, text, conf) in result_sorted:
-                y_pos = bbox[0][1]
-                
-                if current_y == -1 or abs(y_pos - current_y) > 30:
-                    if lines:
-                        lines.append('\n')
-                    current_y = y_pos
-                else:
-                    lines.append(' ')
-                
-                lines.append(text)
-            
-            full_text = ''.join(lines)
+            full_text = group_easyocr_lines(result)
             avg_confidence = sum([conf for (_, _, conf) in result]) / len(result)
             
-            print(f"  ✅ EasyOCR succeeded")
+            log.info(f"  ✅ EasyOCR succeeded")
             return {
                 "text": full_text,
                 "confidence": avg_confidence,
@@ -209,7 +483,7 @@ class HybridOCR:
             }
             
         except Exception as e:
-            print(f"  ❌ EasyOCR error: {e}")
+            log.error(f"  ❌ EasyOCR error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
     def _is_good_result(self, result):
@@ -219,35 +493,28 @@ class HybridOCR:
                 result.get('confidence', 0) > 0.1)
     
     def cleanup(self):
-        """Clean up all models that were actually loaded"""
-        cleaned = []
-        
-        if self.florence_ocr and hasattr(self.florence_ocr, 'available') and self.florence_ocr.available:
-            try:
-                self.florence_ocr.cleanup()
-                cleaned.append("Florence-2")
-            except:
-                pass
-        
-        if self.got_ocr and hasattr(self.got_ocr, 'available') and self.got_ocr.available:
-            try:
-                self.got_ocr.cleanup()
-                cleaned.append("GOT-OCR 2.0")
-            except:
-                pass
-        
-        if self.easy_ocr and hasattr(self, 'easy_reader'):
-            try:
-                del self.easy_reader
-                cleaned.append("EasyOCR")
-            except:
-                pass
+        """
+        Clean up all models that were actually loaded
+        Models are shared, so this unloads them for every HybridOCR in the process
+        """
+        self.api_ocr = None
+        self.florence_ocr = None
+        self.got_ocr = None
+        self.easy_reader = None
+        cleaned = release_all()
         
+        if cleaned:
+            log.info(f"✅ Cleaned up: {', '.join(cleaned)}")
+        else:
+            log.info("✅ Cleanup complete (no models were loaded)")
+    
+    def release_gpu_memory(self):
+        """
+        Return PyTorch's cached GPU memory to the driver
+        Not part of cleanup(): the cache is what makes the next model load cheap.
+        Call this explicitly before handing the GPU to another process.
+        """
         import torch
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-        
-        if cleaned:
-            print(f"✅ Cleaned up: {', '.join(cleaned)}")
-        else:
-            print("✅ Cleanup complete (no models were loaded)")
\ No newline at end of file
+            log.info("✅ Released cached GPU memory")
\ No newline at end of file
@@ -0,0 +1,54 @@
+import logging
+import json
+import os
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+class OCRResultCache:
+    """
+    On-disk cache of OCR results, keyed by image content digest and OCR model
+    Lets reruns after a crash or config tweak skip pages that were already OCR'd
+    """
+    
+    def __init__(self, cache_dir="cache/ocr"):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+    
+    def path_for(self, digest, model_key):
+        """Cache file location for an image digest + model combination"""
+        return self.cache_dir / f"{digest}_{model_key}.json"
+    
+    def get(self, digest, model_key):
+        """
+        Load a cached OCR result
+        
+        Returns:
+            dict with 'text', 'confidence', 'method', or None on a cache miss
+        """
+        path = self.path_for(digest, model_key)
+        if not path.exists():
+            return None
+        
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            log.warning(f"⚠️ Ignoring unreadable OCR cache entry {path.name}: {e}")
+            return None
+    
+    def put(self, digest, model_key, result):
+        """Store an OCR result atomically (failed/empty results are not cached)"""
+        if not result.get('text'):
+            return
+        
+        path = self.path_for(digest, model_key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, default=float)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.warning(f"⚠️ Could not write OCR cache entry {path.name}: {e}")
+            if tmp_path.exists():
+                tmp_path.unlink()
@@ -1,28 +1,58 @@
+import logging
 import os
+import json
+import mimetypes
+from collections import OrderedDict
 import requests
-from dotenv import load_dotenv
-import base64
+from requests.adapters import HTTPAdapter
 import cv2
 import numpy as np
+from ..config import GROQ_API_KEY, MATHPIX_APP_ID, MATHPIX_APP_KEY
+from .easyocr_utils import group_easyocr_lines, load_for_easyocr, rescale_boxes, warm_up_easyocr
 
-load_dotenv()
+log = logging.getLogger(__name__)
+
+try:
+    # Streams multipart uploads from disk; without it requests builds the body in memory
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+# readtext() results kept per engine (pages x distinct option sets)
+EASY_CACHE_SIZE = 32
 
 class OCREngine:
     """Handles OCR using multiple engines"""
     
-    def __init__(self):
-        self.groq_key = os.getenv('GROQ_API_KEY')
-        self.mathpix_id = os.getenv('MATHPIX_APP_ID')
-        self.mathpix_key = os.getenv('MATHPIX_APP_KEY')
+    def __init__(self, prefer_gpu=True):
+        """
+        Args:
+            prefer_gpu: Run EasyOCR on CUDA when available; pass False to keep it on the
+                CPU when the GPU is shared with Florence-2 / GOT-OCR
+        """
+        self.groq_key = GROQ_API_KEY
+        self.mathpix_id = MATHPIX_APP_ID
+        self.mathpix_key = MATHPIX_APP_KEY
+        
+        # One keep-alive session for Mathpix, so repeated calls skip the TCP + TLS handshake
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=2))
+        
+        # Raw readtext() output, so detection and extraction on one image share a single pass
+        self._easy_cache = OrderedDict()
         
         # Initialize EasyOCR with better settings
         try:
             import easyocr
-            self.easy_reader = easyocr.Reader(['en'], gpu=False, verbose=False)
-            print("✅ EasyOCR initialized")
+            import torch
+            gpu = prefer_gpu and torch.cuda.is_available()
+            # quantize applies int8 dynamic quantization on the CPU path only
+            self.easy_reader = easyocr.Reader(['en'], gpu=gpu, quantize=not gpu, verbose=False)
+            warm_up_easyocr(self.easy_reader)
+            log.info(f"✅ EasyOCR initialized ({'GPU' if gpu else 'CPU'})")
         except Exception as e:
             self.easy_reader = None
-            print(f"⚠️ EasyOCR error: {e}")
+            log.warning(f"⚠️ EasyOCR error: {e}")
     
     def extract_text(self, image_path, region_type='text_block'):
         """
@@ -38,51 +68,30 @@ class OCREngine:
     
     def _extract_full_page(self, image_path):
         """Extract all text from full page image"""
-        print(f"  Running full-page OCR...")
+        log.info(f"  Running full-page OCR...")
         
         if self.easy_reader is None:
             return {"text": "[OCR Error: EasyOCR not initialized]", "confidence": 0}
         
         try:
             # Run EasyOCR with paragraph mode
-            result = self.easy_reader.readtext(
+            result = self._easy_read(
                 image_path, 
-                detail=1,
                 paragraph=False,  # Get individual text blocks
                 width_ths=0.7,    # Adjust text block width threshold
                 height_ths=0.7    # Adjust text block height threshold
             )
             
             if not result:
-                print("  ⚠️ No text detected!")
+                log.warning("  ⚠️ No text detected!")
                 return {"text": "", "confidence": 0, "details": []}
             
-            # Sort by vertical position (top to bottom, left to right)
-            result_sorted = sorted(result, key=lambda x: (x[0][0][1], x[0][0][0]))
-            
-            # Combine text with line breaks
-            lines = []
-            current_y = -1
-            line_threshold = 30  # pixels
-            
-            for (bbox, text, conf) in result_sorted:
-                y_pos = bbox[0][1]
-                
-                # Check if new line
-                if current_y == -1 or abs(y_pos - current_y) > line_threshold:
-                    if lines and lines[-1]:  # Add newline if not empty
-                        lines.append('\n')
-                    current_y = y_pos
-                else:
-                    lines.append(' ')  # Same line, add space
-                
-                lines.append(text)
-            
-            full_text = ''.join(lines)
+            # Combine text with line breaks (top to bottom, left to right)
+            full_text = group_easyocr_lines(result, line_threshold=30)
             avg_confidence = sum([conf for (bbox, text, conf) in result]) / len(result)
             
-            print(f"  ✅ Extracted {len(result)} text blocks (avg confidence: {avg_confidence:.2f})")
-            print(f"  Preview: {full_text[:100]}...")
+            log.info(f"  ✅ Extracted {len(result)} text blocks (avg confidence: {avg_confidence:.2f})")
+            log.debug(f"  Preview: {full_text[:100]}...")
             
             return {
                 "text": full_text,
@@ -91,16 +100,36 @@ class OCREngine:
             }
             
         except Exception as e:
-            print(f"  ❌ EasyOCR error: {e}")
+            log.error(f"  ❌ EasyOCR error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
+    def _easy_read(self, image_path, **options):
+        """
+        EasyOCR readtext(detail=1), cached per file version and options
+        mtime and size stand in for a content hash, so an overwritten file is re-read
+        """
+        stat = os.stat(image_path)
+        key = (image_path, stat.st_mtime_ns, stat.st_size, tuple(sorted(options.items())))
+        
+        if key in self._easy_cache:
+            self._easy_cache.move_to_end(key)
+            return self._easy_cache[key]
+        
+        # Boxes are mapped back to original coordinates, so line grouping and details are unchanged
+        image, scale = load_for_easyocr(image_path)
+        result = rescale_boxes(self.easy_reader.readtext(image, detail=1, **options), scale)
+        self._easy_cache[key] = result
+        if len(self._easy_cache) > EASY_CACHE_SIZE:
+            self._easy_cache.popitem(last=False)
+        return result
+    
     def _extract_handwriting(self, image_path):
         """Extract handwritten text using EasyOCR"""
         if self.easy_reader is None:
             return {"text": "[OCR Error: EasyOCR not initialized]", "confidence": 0}
         
         try:
-            result = self.easy_reader.readtext(image_path, detail=1)
+            result = self._easy_read(image_path)
             
             if not result:
                 return {"text": "", "confidence": 0, "details": []}
@@ -115,37 +144,47 @@ class OCREngine:
                 "details": result
             }
         except Exception as e:
-            print(f"❌ EasyOCR error: {e}")
+            log.error(f"❌ EasyOCR error: {e}")
             return {"text": "", "confidence": 0, "error": str(e)}
     
     def _extract_math(self, image_path):
         """Extract mathematical equations using Mathpix"""
         if not self.mathpix_id or not self.mathpix_key:
-            print("⚠️ Mathpix API not configured, using EasyOCR")
+            log.warning("⚠️ Mathpix API not configured, using EasyOCR")
             return self._extract_handwriting(image_path)
         
         try:
-            with open(image_path, 'rb') as img_file:
-                img_base64 = base64.b64encode(img_file.read()).decode()
-            
             headers = {
                 'app_id': self.mathpix_id,
-                'app_key': self.mathpix_key,
-                'Content-Type': 'application/json'
+                'app_key': self.mathpix_key
             }
             
-            data = {
-                'src': f'data:image/png;base64,{img_base64}',
+            options_json = json.dumps({
                 'formats': ['text', 'latex_simplified'],
                 'ocr': ['math', 'text']
-            }
+            })
             
-            response = requests.post(
-                'https://api.mathpix.com/v3/text',
-                json=data,
-                headers=headers,
-                timeout=30
-            )
+            # Upload the raw file as multipart instead of a base64 data URL inside JSON
+            mime_type = mimetypes.guess_type(image_path)[0] or 'application/octet-stream'
+            with open(image_path, 'rb') as img_file:
+                upload = ('file', (os.path.basename(image_path), img_file, mime_type))
+                
+                if MultipartEncoder is not None:
+                    body = MultipartEncoder(fields=[upload, ('options_json', options_json)])
+                    response = self.session.post(
+                        'https://api.mathpix.com/v3/text',
+                        data=body,
+                        headers={**headers, 'Content-Type': body.content_type},
+                        timeout=30
+                    )
+                else:
+                    response = self.session.post(
+                        'https://api.mathpix.com/v3/text',
+                        files=[upload],
+                        data={'options_json': options_json},
+                        headers=headers,
+                        timeout=30
+                    )
             
             if response.status_code == 200:
                 result = response.json()
@@ -155,11 +194,11 @@ class OCREngine:
                     "confidence": result.get('confidence', 0)
                 }
             else:
-                print(f"⚠️ Mathpix API error: {response.status_code}")
+                log.warning(f"⚠️ Mathpix API error: {response.status_code}")
                 return self._extract_handwriting(image_path)
                 
         except Exception as e:
-            print(f"❌ Mathpix error: {e}")
+            log.error(f"❌ Mathpix error: {e}")
             return self._extract_handwriting(image_path)
     
     def _extract_diagram(self, image_path):
@@ -173,7 +212,7 @@ class OCREngine:
     def _has_math_symbols(self, image_path):
         """Simple heuristic to detect if image might contain math"""
         if self.easy_reader:
-            result = self.easy_reader.readtext(image_path)
+            result = self._easy_read(image_path)
             text = ' '.join([t for (bbox, t, conf) in result])
             math_indicators = ['=', '+', '-', '×', '÷', 'Δ', '→', '∫', '∂', 'Σ', '∑']
             return any(symbol in text for symbol in math_indicators)
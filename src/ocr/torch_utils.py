@@ -0,0 +1,66 @@
+import logging
+import os
+
+# Must be set before CUDA initializes: growable segments keep fragmentation down
+# when models of different sizes are loaded and unloaded in one process.
+# The local model modules import this one before torch for that reason.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
+import threading
+
+import torch
+
+log = logging.getLogger(__name__)
+
+# Compiled kernels are reused across runs instead of re-tuned on every start
+INDUCTOR_CACHE_DIR = "cache/torchinductor"
+
+
+class GenerationGuard:
+    """
+    Serializes generate calls on a shared local model and owns its torch.compile state
+    One generate at a time: the model is shared across threads, and falling back to
+    eager swaps the compiled forward out from under any concurrent call
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._compiled_module = None  # module whose forward is currently compiled
+    
+    @property
+    def compiled(self):
+        return self._compiled_module is not None
+    
+    def compile(self, module):
+        """
+        Replace module.forward (the step run at every decode token) with a compiled one
+        
+        Returns:
+            True if compiled, False if torch.compile is unavailable (the model runs eager)
+        """
+        try:
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.abspath(INDUCTOR_CACHE_DIR))
+            # dynamic=True: the KV cache grows every step, so avoid a recompile per length
+            module.forward = torch.compile(module.forward, dynamic=True)
+            self._compiled_module = module
+            return True
+        except Exception as e:
+            log.warning(f"   ⚠️ torch.compile unavailable, running eager: {e}")
+            return False
+    
+    def run(self, generate):
+        """
+        Call generate() under the lock, retrying once in eager mode if the compiled
+        forward fails (torch.compile only fails at the first call, e.g. no Triton backend)
+        """
+        with self.lock:
+            try:
+                return generate()
+            except Exception as e:
+                if not self.compiled:
+                    raise
+                log.warning(f"  ⚠️ Compiled forward failed, switching to eager mode: {e}")
+                # Deleting the instance attribute restores the class's eager forward
+                del self._compiled_module.forward
+                self._compiled_module = None
+                return generate()
@@ -1,41 +1,21 @@
-import os
+import logging
+import asyncio
 import base64
-from groq import Groq
-from dotenv import load_dotenv
+import hashlib
+import io
+import threading
+from concurrent.futures import Future
+from PIL import Image, ImageOps
+from groq import AsyncGroq
+from ..config import GROQ_API_KEY
+from ..groq_client import MAX_RETRIES, get_groq_client, new_async_http_client, run_batch
+from .ocr_cache import OCRResultCache
 
-load_dotenv()
+log = logging.getLogger(__name__)
 
-class VisionOCR:
-    """Use multimodal LLM for better handwriting OCR"""
-    
-    def __init__(self):
-        self.groq_key = os.getenv('GROQ_API_KEY')
-        self.client = Groq(api_key=self.groq_key) if self.groq_key else None
-        print("✅ Vision OCR initialized")
-    
-    def extract_text_from_image(self, image_path):
-        """
-        Use Llama 3.2 Vision (via Groq) to extract text
-        """
-        if not self.client:
-            print("❌ Groq API not available")
-            return {"text": "", "confidence": 0}
-        
-        try:
-            # Read and encode image
-            with open(image_path, 'rb') as img_file:
-                image_data = base64.b64encode(img_file.read()).decode('utf-8')
-            
-            # Groq supports Llama 3.2 Vision models
-            completion = self.client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",  # Vision model
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """Extract ALL text from this handwritten chemistry notes image.
+VISION_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+OCR_PROMPT = """Extract ALL text from this handwritten chemistry notes image.
 
 Rules:
 1. Transcribe EXACTLY what you see, including all text, equations, and formulas
@@ -58,32 +38,268 @@ Rules:
         Integrals as integral(expression, variable, lower, upper) if needed
         Piecewise functions using words or simple if-then notation
 Output only the transcribed text with diagram descriptions."""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_data}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                temperature=0.1,
-                max_tokens=4000
-            )
+
+# Pages are downscaled to this longest side and re-encoded before upload - the model
+# downsamples internally anyway, so larger phone photos only cost upload time
+VISION_MAX_SIDE = 1568
+UPLOAD_JPEG_QUALITY = 85
+
+# data: URL headers by file signature (anything else is sent as JPEG, as before)
+_PNG_SIGNATURE = b"\x89PNG"
+_PNG_URL_PREFIX = b"data:image/png;base64,"
+_JPEG_URL_PREFIX = b"data:image/jpeg;base64,"
+
+# Response cache key: changing the model or the prompt starts a fresh set of entries
+CACHE_KEY = "llama_vision_" + hashlib.sha256((VISION_MODEL + OCR_PROMPT).encode()).hexdigest()[:8]
+
+
+class VisionOCR:
+    """Use multimodal LLM for better handwriting OCR"""
+    
+    def __init__(self, cache_dir="cache/vision"):
+        self.groq_key = GROQ_API_KEY
+        self.client = get_groq_client()
+        # Responses keyed by SHA-256 of the image bytes - rerunning a notebook skips the API
+        self.cache = OCRResultCache(cache_dir)
+        # digest -> Future of the request currently running for those bytes
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        log.info("✅ Vision OCR initialized")
+    
+    def extract_text_from_image(self, image_path):
+        """
+        Use Llama 3.2 Vision (via Groq) to extract text
+        """
+        if not self.client:
+            log.error("❌ Groq API not available")
+            return {"text": "", "confidence": 0}
+        
+        try:
+            image_bytes, digest = self._read_image(image_path)
+            cached = self.cache.get(digest, CACHE_KEY)
+            if cached:
+                log.info("✅ Vision OCR served from cache")
+                return cached
             
-            extracted_text = completion.choices[0].message.content.strip()
+            # Identical pages requested concurrently (a rescanned page, a folder uploaded
+            # twice) share one API call: the first caller makes it, the others wait for it
+            with self._inflight_lock:
+                pending = self._inflight.get(digest)
+                if pending is None:
+                    self._inflight[digest] = future = Future()
+            if pending is not None:
+                return pending.result()
             
-            print(f"✅ Vision OCR complete")
-            print(f"   Extracted {len(extracted_text)} characters")
-            print(f"   Preview: {extracted_text[:100]}...")
+            try:
+                # Only the encoded payload needs to stay alive for the request
+                request = self._ocr_request(image_bytes)
+                del image_bytes
+                completion = self.client.chat.completions.create(**request)
+                result = self._store(digest, self._parse_completion(completion))
+            except Exception as e:
+                log.error(f"❌ Vision OCR error: {e}")
+                result = {"text": "", "confidence": 0, "error": str(e)}
+            except BaseException as e:
+                # Interrupted (Ctrl+C, Streamlit stop) - waiting callers must not block forever
+                future.set_exception(e)
+                raise
+            finally:
+                with self._inflight_lock:
+                    del self._inflight[digest]
             
-            return {
-                "text": extracted_text,
-                "confidence": 0.95,  # Vision models are much better
-                "method": "llama_vision"
-            }
+            future.set_result(result)
+            return result
             
         except Exception as e:
-            print(f"❌ Vision OCR error: {e}")
-            return {"text": "", "confidence": 0, "error": str(e)}
\ No newline at end of file
+            log.error(f"❌ Vision OCR error: {e}")
+            return {"text": "", "confidence": 0, "error": str(e)}
+    
+    async def extract_text_from_image_async(self, client, image_path, inflight=None):
+        """
+        Async variant of extract_text_from_image
+        
+        Args:
+            client: AsyncGroq client (share one across calls to reuse connections)
+            inflight: dict shared by the calls of one batch - pages with identical bytes
+                      then share a single request
+        """
+        try:
+            image_bytes, digest = self._read_image(image_path)
+            cached = self.cache.get(digest, CACHE_KEY)
+            if cached:
+                log.info("✅ Vision OCR served from cache")
+                return cached
+            
+            future = None
+            if inflight is not None:
+                if digest in inflight:
+                    return await inflight[digest]
+                future = inflight[digest] = asyncio.get_running_loop().create_future()
+            
+            try:
+                # Every page in a batch is in flight at once - don't hold its raw bytes as well
+                request = self._ocr_request(image_bytes)
+                del image_bytes
+                completion = await client.chat.completions.create(**request)
+                result = self._store(digest, self._parse_completion(completion))
+            except Exception as e:
+                log.error(f"❌ Vision OCR error: {e}")
+                result = {"text": "", "confidence": 0, "error": str(e)}
+            except BaseException:
+                # Cancelled - pages awaiting this request are cancelled with it
+                if future:
+                    del inflight[digest]
+                    future.cancel()
+                raise
+            
+            if future:
+                future.set_result(result)
+            return result
+            
+        except Exception as e:
+            log.error(f"❌ Vision OCR error: {e}")
+            return {"text": "", "confidence": 0, "error": str(e)}
+    
+    def extract_batch(self, image_paths):
+        """
+        OCR several pages with their requests in flight concurrently over one connection pool
+        
+        Returns:
+            list of dicts with 'text', 'confidence', 'method' (in page order)
+        """
+        if not self.client:
+            log.error("❌ Groq API not available")
+            return [{"text": "", "confidence": 0} for _ in image_paths]
+        
+        if len(image_paths) == 1:
+            return [self.extract_text_from_image(image_paths[0])]
+        
+        async def extract_all():
+            async with AsyncGroq(api_key=self.groq_key, http_client=new_async_http_client(),
+                                 max_retries=MAX_RETRIES) as client:
+                inflight = {}
+                return await asyncio.gather(*[
+                    self.extract_text_from_image_async(client, path, inflight) for path in image_paths
+                ])
+        
+        return list(asyncio.run(extract_all()))
+    
+    def extract_batch_offline(self, image_paths):
+        """
+        OCR pages through Groq's Batch API - half the cost, but results can take up to 24h
+        For bulk/archival jobs; blocks until the batch finishes. Cached pages are not resubmitted.
+        
+        Returns:
+            list of dicts with 'text', 'confidence', 'method' (in page order)
+        """
+        if not self.client:
+            log.error("❌ Groq API not available")
+            return [{"text": "", "confidence": 0} for _ in image_paths]
+        
+        results = [None] * len(image_paths)
+        digests, bodies = {}, []
+        for idx, path in enumerate(image_paths):
+            try:
+                image_bytes, digest = self._read_image(path)
+            except Exception as e:
+                results[idx] = {"text": "", "confidence": 0, "error": str(e)}
+                continue
+            results[idx] = self.cache.get(digest, CACHE_KEY)
+            if results[idx] is None:
+                digests[idx] = digest
+                bodies.append(self._ocr_request(image_bytes))
+        
+        if bodies:
+            try:
+                texts = run_batch(self.client, bodies)
+            except Exception as e:
+                log.error(f"❌ Vision OCR batch error: {e}")
+                texts = [None] * len(bodies)
+            
+            for (idx, digest), text in zip(digests.items(), texts):
+                if text is None:
+                    results[idx] = {"text": "", "confidence": 0, "error": "batch request failed"}
+                else:
+                    results[idx] = self._store(digest, self._result_from_text(text))
+        
+        return results
+    
+    def _read_image(self, image_path):
+        """Image file bytes and their SHA-256 hex digest"""
+        with open(image_path, 'rb') as img_file:
+            image_bytes = img_file.read()
+        return image_bytes, hashlib.sha256(image_bytes).hexdigest()
+    
+    def _store(self, digest, result):
+        """Cache a successful response and pass it through"""
+        self.cache.put(digest, CACHE_KEY, result)
+        return result
+    
+    def _ocr_request(self, image_bytes):
+        """Build chat completion arguments for one page"""
+        # Groq supports Llama 3.2 Vision models
+        return {
+            "model": VISION_MODEL,  # Vision model
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": OCR_PROMPT
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": self._data_url(self._upload_bytes(image_bytes))
+                            }
+                        }
+                    ]
+                }
+            ],
+            "temperature": 0.1,
+            "max_tokens": 4000
+        }
+    
+    def _upload_bytes(self, image_bytes):
+        """Image bytes to upload: the file as-is if small enough, else a downscaled JPEG"""
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            if max(image.size) <= VISION_MAX_SIDE:
+                return image_bytes
+            
+            # JPEGs decode at reduced scale; a no-op for other formats
+            image.draft('RGB', (VISION_MAX_SIDE, VISION_MAX_SIDE))
+            # Re-encoding drops EXIF, so apply its rotation to the pixels first
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.Resampling.LANCZOS)
+            
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=UPLOAD_JPEG_QUALITY, optimize=True)
+            return buffer.getvalue()
+        except Exception as e:
+            log.warning(f"⚠️ Could not downscale image, uploading original: {e}")
+            return image_bytes
+    
+    def _data_url(self, image_bytes):
+        """base64 data URL for the image (MIME type from the file signature)"""
+        prefix = _PNG_URL_PREFIX if image_bytes.startswith(_PNG_SIGNATURE) else _JPEG_URL_PREFIX
+        return (prefix + base64.b64encode(image_bytes)).decode('ascii')
+    
+    def _parse_completion(self, completion):
+        """Turn a chat completion into the OCR result dict"""
+        return self._result_from_text(completion.choices[0].message.content)
+    
+    def _result_from_text(self, text):
+        """OCR result dict for the model's response text"""
+        extracted_text = text.strip()
+        
+        log.info(f"✅ Vision OCR complete")
+        log.info(f"   Extracted {len(extracted_text)} characters")
+        log.debug(f"   Preview: {extracted_text[:100]}...")
+        
+        return {
+            "text": extracted_text,
+            "confidence": 0.95,  # Vision models are much better
+            "method": "llama_vision"
+        }
@@ -1,20 +1,99 @@
-import os
-from groq import Groq
-from dotenv import load_dotenv
+import logging
+import asyncio
+from groq import AsyncGroq
+from ..config import GROQ_API_KEY
+from ..groq_client import MAX_RETRIES, get_groq_client, new_async_http_client, run_batch, stream_text
+
+log = logging.getLogger(__name__)
+
+CORRECTION_MODEL = "llama-3.3-70b-versatile"
+
+# System prompts hold every fixed instruction and the page goes last in the user message,
+# so consecutive requests share a byte-identical prefix that the provider's prompt cache
+# can reuse. Keep these constant - any per-call formatting here defeats the cache.
+CORRECTION_SYSTEM_PROMPT = """You correct OCR errors in scientific notes. Return ONLY the corrected text. Never add content that wasn't in the original. Preserve all technical accuracy.
+
+The user message is OCR output from handwritten notes. The OCR may have errors in:
+- Spelling
+- Chemical formulas (preserve subscripts as numbers: H2O not H₂O)
+- Mathematical symbols
+- Formatting
+
+Instructions:
+1. Fix spelling errors
+2. Preserve ALL chemical formulas (H2O, CaCl2, ΔH, etc.)
+3. Preserve mathematical symbols and equations
+4. Fix obvious OCR mistakes
+5. Keep technical terms accurate
+6. Return ONLY the corrected text - NO explanations, NO made-up content
+7. If text mentions diagrams or boxes, keep those references"""
+
+STRUCTURE_SYSTEM_PROMPT = """You structure scientific notes into readable markdown. Keep all original content. Don't add or invent content.
+
+The user message is handwritten chemistry notes. Structure them properly.
+
+Instructions:
+1. Add markdown headings where appropriate (# for main, ## for sub)
+2. Keep all content from original - don't add or remove
+3. Organize into logical sections
+4. Preserve all equations, formulas, and diagrams
+5. Use bullet points for lists
+6. Keep [DIAGRAM] markers
+7. Instructions:
+    Do not return answers in LaTeX format.
+    Write all mathematical formulas in plain text, using standard symbols.
+    For example:
+    Fractions as a / b
+    Powers as x^2
+    Subscripts as I_DC
+    Integrals as integral(expression, variable, lower, upper) if needed
+    Piecewise functions using words or simple if-then notation
+***IMPORTANT***
+DONOT ADD ANY OTHER LINE OR DESCRIPTION FROM YOURSELF. YOUR TASK IS TO CORRECT THE CONTENT. 
+DONOT ADD ADDITIONAL TEXT
+
+Return structured markdown."""
+
+# correct_text + structure_content in one round trip
+CORRECT_AND_STRUCTURE_SYSTEM_PROMPT = """You correct OCR errors in scientific notes AND structure them into readable markdown. Never add content that wasn't in the original. Preserve all technical accuracy.
+
+The user message is OCR output from handwritten notes. The OCR may have errors in:
+- Spelling
+- Chemical formulas (preserve subscripts as numbers: H2O not H₂O)
+- Mathematical symbols
+- Formatting
+
+Instructions:
+1. Fix spelling errors and obvious OCR mistakes
+2. Preserve ALL chemical formulas (H2O, CaCl2, ΔH, etc.), mathematical symbols and equations
+3. Keep technical terms accurate
+4. Add markdown headings where appropriate (# for main, ## for sub)
+5. Organize into logical sections and use bullet points for lists
+6. Keep all content from original - don't add or remove
+7. Keep [DIAGRAM] markers and any references to diagrams or boxes
+8. Do not return answers in LaTeX format.
+    Write all mathematical formulas in plain text, using standard symbols.
+    For example:
+    Fractions as a / b
+    Powers as x^2
+    Subscripts as I_DC
+    Integrals as integral(expression, variable, lower, upper) if needed
+    Piecewise functions using words or simple if-then notation
+***IMPORTANT***
+Return ONLY the corrected, structured markdown - NO explanations, NO made-up content."""
 
-load_dotenv()
 
 class LLMCorrector:
     """Uses Groq + Llama for intelligent OCR correction"""
     
     def __init__(self):
-        api_key = os.getenv('GROQ_API_KEY')
-        if not api_key:
-            print("⚠️ Groq API key not found")
+        self.api_key = GROQ_API_KEY
+        if not self.api_key:
+            log.warning("⚠️ Groq API key not found")
             self.client = None
         else:
-            self.client = Groq(api_key=api_key)
-            print("✅ Groq client initialized")
+            self.client = get_groq_client()
+            log.info("✅ Groq client initialized")
     
     def correct_text(self, ocr_text, context="chemistry notes"):
         """
@@ -22,65 +101,197 @@ class LLMCorrector:
         """
         # Don't process empty text
         if not ocr_text or len(ocr_text.strip()) < 10:
-            print("⚠️ OCR text too short or empty, skipping LLM correction")
+            log.warning("⚠️ OCR text too short or empty, skipping LLM correction")
             return ocr_text
         
         if not self.client:
-            print("⚠️ Groq not available, returning uncorrected text")
+            log.warning("⚠️ Groq not available, returning uncorrected text")
             return ocr_text
         
-        prompt = f"""You are correcting OCR output from handwritten {context}.
-
-The OCR may have errors in:
-- Spelling
-- Chemical formulas (preserve subscripts as numbers: H2O not H₂O)
-- Mathematical symbols
-- Formatting
-
-OCR Output:
-{ocr_text}
-
-Instructions:
-1. Fix spelling errors
-2. Preserve ALL chemical formulas (H2O, CaCl2, ΔH, etc.)
-3. Preserve mathematical symbols and equations
-4. Fix obvious OCR mistakes
-5. Keep technical terms accurate
-6. Return ONLY the corrected text - NO explanations, NO made-up content
-7. If text mentions diagrams or boxes, keep those references
-
-Corrected text:"""
-
         try:
             completion = self.client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You correct OCR errors in scientific notes. Return ONLY the corrected text. Never add content that wasn't in the original. Preserve all technical accuracy."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                temperature=0.1,  # Lower temperature for less creativity
-                max_tokens=4000
+                **self._correction_request(ocr_text, context)
+            )
+            return self._validate_correction(completion, ocr_text)
+            
+        except Exception as e:
+            log.error(f"❌ Groq error: {e}")
+            return ocr_text
+    
+    def correct_and_structure(self, ocr_text, context="chemistry notes"):
+        """
+        Correct OCR errors and structure the result as markdown in a single LLM call
+        Same result as structure_content(correct_text(...)) for half the round trips and tokens
+        """
+        # Don't process empty text
+        if not ocr_text or len(ocr_text.strip()) < 10:
+            log.warning("⚠️ OCR text too short or empty, skipping LLM correction")
+            return ocr_text
+        
+        if not self.client:
+            log.warning("⚠️ Groq not available, returning uncorrected text")
+            return ocr_text
+        
+        try:
+            completion = self.client.chat.completions.create(
+                **self._correct_and_structure_request(ocr_text, context)
             )
+            return self._validate_correction(completion, ocr_text)
             
-            corrected = completion.choices[0].message.content.strip()
+        except Exception as e:
+            log.error(f"❌ Groq error: {e}")
+            return ocr_text
+    
+    def correct_and_structure_stream(self, ocr_text, context="chemistry notes"):
+        """
+        Streaming variant of correct_and_structure - yields markdown chunks as they are generated
+        The hallucination check needs the complete response, so pass the joined chunks through
+        validate_text() once the stream ends. The original text is yielded on errors before any output.
+        """
+        if not ocr_text or len(ocr_text.strip()) < 10 or not self.client:
+            yield ocr_text
+            return
+        
+        streamed = False
+        try:
+            for chunk in stream_text(self.client, self._correct_and_structure_request(ocr_text, context)):
+                streamed = True
+                yield chunk
+        except Exception as e:
+            log.error(f"❌ Groq error: {e}")
+            if not streamed:
+                yield ocr_text
+    
+    def _correct_and_structure_request(self, ocr_text, context):
+        """Build chat completion arguments for the fused correct + structure call"""
+        return {
+            "model": CORRECTION_MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": CORRECT_AND_STRUCTURE_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": f"Notes type: {context}\n\nOCR Output:\n{ocr_text}"
+                }
+            ],
+            "temperature": 0.1,
+            "max_tokens": 4000
+        }
+    
+    async def correct_text_async(self, client, ocr_text, context="chemistry notes"):
+        """
+        Async variant of correct_text
+        
+        Args:
+            client: AsyncGroq client (share one across calls to reuse connections)
+        """
+        if not ocr_text or len(ocr_text.strip()) < 10:
+            log.warning("⚠️ OCR text too short or empty, skipping LLM correction")
+            return ocr_text
+        
+        try:
+            completion = await client.chat.completions.create(
+                **self._correction_request(ocr_text, context)
+            )
+            return self._validate_correction(completion, ocr_text)
             
-            # Validate that we got actual correction, not hallucination
-            if "please provide" in corrected.lower() or "i'd be happy" in corrected.lower():
-                print("⚠️ LLM hallucinated, returning original OCR")
-                return ocr_text
+        except Exception as e:
+            log.error(f"❌ Groq error: {e}")
+            return ocr_text
+    
+    def correct_pages(self, page_texts, context="chemistry notes", mode="realtime"):
+        """
+        Correct several pages concurrently over one connection pool
+        
+        Args:
+            mode: "realtime", or "batch" to go through the Batch API (see correct_batch_offline)
             
-            print(f"✅ Text corrected by Llama 3.3")
+        Returns:
+            list of corrected texts in page order
+        """
+        if not self.client:
+            log.warning("⚠️ Groq not available, returning uncorrected text")
+            return list(page_texts)
+        
+        if mode == "batch":
+            return self.correct_batch_offline(page_texts, context)
+        
+        if len(page_texts) == 1:
+            return [self.correct_text(page_texts[0], context)]
+        
+        async def correct_all():
+            async with AsyncGroq(api_key=self.api_key, http_client=new_async_http_client(),
+                                 max_retries=MAX_RETRIES) as client:
+                return await asyncio.gather(*[
+                    self.correct_text_async(client, text, context) for text in page_texts
+                ])
+        
+        return list(asyncio.run(correct_all()))
+    
+    def correct_batch_offline(self, page_texts, context="chemistry notes"):
+        """
+        Correct pages through Groq's Batch API - half the cost, but results can take up to 24h
+        For bulk/archival jobs; blocks until the batch finishes.
+        
+        Returns:
+            list of corrected texts in page order (uncorrected where a request failed)
+        """
+        if not self.client:
+            log.warning("⚠️ Groq not available, returning uncorrected text")
+            return list(page_texts)
+        
+        # Near-empty pages skip correction, same as correct_text
+        pending = [idx for idx, text in enumerate(page_texts) if text and len(text.strip()) >= 10]
+        corrected = list(page_texts)
+        if not pending:
             return corrected
-            
+        
+        try:
+            texts = run_batch(self.client, [self._correction_request(page_texts[idx], context) for idx in pending])
         except Exception as e:
-            print(f"❌ Groq error: {e}")
+            log.error(f"❌ Groq batch error: {e}")
+            return corrected
+        
+        for idx, text in zip(pending, texts):
+            if text is not None:
+                corrected[idx] = self.validate_text(text, page_texts[idx])
+        return corrected
+    
+    def _correction_request(self, ocr_text, context):
+        """Build chat completion arguments for OCR correction"""
+        return {
+            "model": CORRECTION_MODEL,
+            "messages": [
+                {
+                    "role": "system", 
+                    "content": CORRECTION_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user", 
+                    "content": f"Notes type: {context}\n\nOCR Output:\n{ocr_text}"
+                }
+            ],
+            "temperature": 0.1,  # Lower temperature for less creativity
+            "max_tokens": 4000
+        }
+    
+    def _validate_correction(self, completion, ocr_text):
+        """Return corrected text, or the original OCR if the LLM hallucinated"""
+        return self.validate_text(completion.choices[0].message.content, ocr_text)
+    
+    def validate_text(self, corrected, ocr_text):
+        """Return the LLM's response text, or the original OCR if the LLM hallucinated"""
+        corrected = corrected.strip()
+        
+        # Validate that we got actual correction, not hallucination
+        if "please provide" in corrected.lower() or "i'd be happy" in corrected.lower():
+            log.warning("⚠️ LLM hallucinated, returning original OCR")
             return ocr_text
+        
+        log.info(f"✅ Text corrected by Llama 3.3")
+        return corrected
     
     def structure_content(self, text_blocks):
         """
@@ -103,44 +314,17 @@ Corrected text:"""
         if not combined_text or len(combined_text.strip()) < 10:
             return combined_text
         
-        prompt = f"""Structure these handwritten chemistry notes properly.
-
-Original Notes:
-{combined_text}
-
-Instructions:
-1. Add markdown headings where appropriate (# for main, ## for sub)
-2. Keep all content from original - don't add or remove
-3. Organize into logical sections
-4. Preserve all equations, formulas, and diagrams
-5. Use bullet points for lists
-6. Keep [DIAGRAM] markers
-7. Instructions:
-    Do not return answers in LaTeX format.
-    Write all mathematical formulas in plain text, using standard symbols.
-    For example:
-    Fractions as a / b
-    Powers as x^2
-    Subscripts as I_DC
-    Integrals as integral(expression, variable, lower, upper) if needed
-    Piecewise functions using words or simple if-then notation
-***IMPORTANT***
-DONOT ADD ANY OTHER LINE OR DESCRIPTION FROM YOURSELF. YOUR TASK IS TO CORRECT THE CONTENT. 
-DONOT ADD ADDITIONAL TEXT
-
-Return structured markdown:"""
-
         try:
             completion = self.client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
+                model=CORRECTION_MODEL,
                 messages=[
                     {
                         "role": "system",
-                        "content": "You structure scientific notes into readable markdown. Keep all original content. Don't add or invent content."
+                        "content": STRUCTURE_SYSTEM_PROMPT
                     },
                     {
                         "role": "user", 
-                        "content": prompt
+                        "content": combined_text
                     }
                 ],
                 temperature=0.2,
@@ -151,11 +335,11 @@ Return structured markdown:"""
             
             # Validate
             if "please provide" in structured.lower():
-                print("⚠️ LLM couldn't structure, returning original")
+                log.warning("⚠️ LLM couldn't structure, returning original")
                 return combined_text
             
             return structured
             
         except Exception as e:
-            print(f"❌ Structuring error: {e}")
-            return combined_text
\ No newline at end of file
+            log.error(f"❌ Structuring error: {e}")
+            return combined_text
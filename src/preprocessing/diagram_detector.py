@@ -1,7 +1,19 @@
+import logging
 import cv2
 import numpy as np
 import os
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from .image_processor import run_with_opencl
+
+log = logging.getLogger(__name__)
+
+# Longest side the diagram heuristic looks at - Hough cost grows with the number of edge
+# pixels, and the coarse "enough lines / closed shapes" decision doesn't need more
+HEURISTIC_MAX_SIDE = 400
+
+# Structuring element for joining nearby edges (allocated once)
+_DILATE_KERNEL = np.ones((3, 3), np.uint8)
 
 class DiagramDetector:
     """
@@ -19,7 +31,7 @@ class DiagramDetector:
         Returns:
             dict with 'has_diagrams', 'diagram_regions', 'text_only_image'
         """
-        print("🔍 Detecting diagrams...")
+        log.info("🔍 Detecting diagrams...")
         
         img = cv2.imread(image_path)
         if img is None:
@@ -28,14 +40,17 @@ class DiagramDetector:
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         height, width = gray.shape
         
+        # Prefix output files with the source name so pages don't overwrite each other
+        prefix = os.path.splitext(os.path.basename(image_path))[0]
+        
         # Detect diagram regions
-        diagram_regions = self._find_diagram_boxes(gray, img)
+        diagram_regions = self._find_diagram_boxes(gray, img, prefix)
         
         if diagram_regions:
-            print(f"  ✅ Found {len(diagram_regions)} diagram(s)")
+            log.info(f"  ✅ Found {len(diagram_regions)} diagram(s)")
             
             # Create text-only version (diagrams masked)
-            text_only_path = self._create_text_only_image(img, diagram_regions)
+            text_only_path = self._create_text_only_image(img, diagram_regions, prefix)
             
             return {
                 'has_diagrams': True,
@@ -44,7 +59,7 @@ class DiagramDetector:
                 'original_image': image_path
             }
         else:
-            print("  No diagrams detected")
+            log.info("  No diagrams detected")
             return {
                 'has_diagrams': False,
                 'diagram_regions': [],
@@ -52,19 +67,12 @@ class DiagramDetector:
                 'original_image': image_path
             }
     
-    def _find_diagram_boxes(self, gray, img):
+    def _find_diagram_boxes(self, gray, img, prefix="page"):
         """
         Find rectangular regions likely containing diagrams/graphs
         """
-        # Preprocessing for contour detection
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        
-        # Edge detection
-        edges = cv2.Canny(blurred, 30, 100)
-        
-        # Dilate to connect nearby edges
-        kernel = np.ones((3, 3), np.uint8)
-        dilated = cv2.dilate(edges, kernel, iterations=2)
+        # Edge mask for contour detection (on the GPU through OpenCL when available)
+        dilated = run_with_opencl(self._edge_mask, gray)
         
         # Find contours
         contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -73,53 +81,95 @@ class DiagramDetector:
         min_area = (w * h) * 0.02  # At least 2% of image
         max_area = (w * h) * 0.5   # At most 50% of image
         
-        diagram_regions = []
+        if not contours:
+            return []
         
-        for i, contour in enumerate(contours):
-            x, y, w_box, h_box = cv2.boundingRect(contour)
-            area = w_box * h_box
-            
-            # Filter by size and aspect ratio
-            if min_area < area < max_area:
-                aspect_ratio = w_box / h_box if h_box > 0 else 0
-                
-                # Diagrams usually have reasonable aspect ratios
-                if 0.3 < aspect_ratio < 3.0:
-                    roi = gray[y:y+h_box, x:x+w_box]
-                    
-                    # Check if region has graph-like features
-                    if self._is_likely_diagram(roi):
-                        # Extract diagram image
-                        diagram_img = img[y:y+h_box, x:x+w_box]
-                        diagram_path = os.path.join(self.output_dir, f"diagram_{i}.png")
-                        cv2.imwrite(diagram_path, diagram_img)
-                        
-                        diagram_regions.append({
-                            'id': i,
-                            'bbox': (x, y, w_box, h_box),
-                            'path': diagram_path,
-                            'area': area,
-                            'center_y': y + h_box // 2
-                        })
+        # Filter by size and aspect ratio on all bounding boxes at once
+        rects = np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.int64)
+        w_boxes, h_boxes = rects[:, 2], rects[:, 3]
+        areas = w_boxes * h_boxes
+        aspect_ratios = np.divide(w_boxes, h_boxes, out=np.zeros(len(rects)), where=h_boxes > 0)
+        
+        # Diagrams usually have reasonable aspect ratios
+        mask = (areas > min_area) & (areas < max_area) & (aspect_ratios > 0.3) & (aspect_ratios < 3.0)
+        candidates = [(int(i), tuple(int(v) for v in rects[i])) for i in np.flatnonzero(mask)]
+        
+        if not candidates:
+            return []
+        
+        # Edge map for the diagram heuristic, computed once for the page - every
+        # candidate region checks a view of it instead of re-running Canny on its ROI
+        roi_edges = run_with_opencl(lambda page: cv2.Canny(page, 50, 150), gray)
+        
+        # The OpenCV calls in the heuristic (and imwrite) release the GIL,
+        # so candidate regions are checked on several cores at once
+        if len(candidates) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(candidates), os.cpu_count() or 1)) as executor:
+                results = list(executor.map(lambda c: self._analyze_roi(roi_edges, img, c[1], c[0], prefix), candidates))
+        else:
+            results = [self._analyze_roi(roi_edges, img, bbox, i, prefix) for i, bbox in candidates]
+        
+        diagram_regions = [region for region in results if region]
         
         # Sort by vertical position
         diagram_regions.sort(key=lambda d: d['center_y'])
         
         return diagram_regions
     
-    def _is_likely_diagram(self, roi):
+    def _edge_mask(self, gray):
+        """Blurred, dilated edge map that joins strokes into region outlines"""
+        # Preprocessing for contour detection
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        
+        # Edge detection
+        edges = cv2.Canny(blurred, 30, 100)
+        
+        # Dilate to connect nearby edges
+        return cv2.dilate(edges, _DILATE_KERNEL, iterations=2)
+    
+    def _analyze_roi(self, edges, img, bbox, i, prefix):
+        """Save the region and return its info if it looks like a diagram, else None"""
+        x, y, w_box, h_box = bbox
+        
+        # Check if region has graph-like features (on a view of the page's edge map)
+        if not self._is_likely_diagram(edges[y:y+h_box, x:x+w_box]):
+            return None
+        
+        # Extract diagram image
+        diagram_img = img[y:y+h_box, x:x+w_box]
+        diagram_path = os.path.join(self.output_dir, f"{prefix}_diagram_{i}.png")
+        cv2.imwrite(diagram_path, diagram_img)
+        
+        return {
+            'id': i,
+            'bbox': (x, y, w_box, h_box),
+            'path': diagram_path,
+            'area': w_box * h_box,
+            'center_y': y + h_box // 2
+        }
+    
+    def _is_likely_diagram(self, edges):
         """
         Heuristic to determine if region contains a diagram/graph
+        
+        Args:
+            edges: Canny(50, 150) edge map of the region
         """
+        # Shrink large regions; pixel thresholds below are scaled to match
+        h, w = edges.shape
+        scale = min(1.0, HEURISTIC_MAX_SIDE / max(h, w))
+        if scale < 1.0:
+            # INTER_AREA keeps thin edges as (grey) nonzero pixels, which both calls treat as edges
+            edges = cv2.resize(edges, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        
         # Check for straight lines (graphs have axes)
-        edges = cv2.Canny(roi, 50, 150)
         lines = cv2.HoughLinesP(
             edges,
             rho=1,
             theta=np.pi/180,
-            threshold=30,
-            minLineLength=20,
-            maxLineGap=5
+            threshold=max(1, round(30 * scale)),
+            minLineLength=max(1, round(20 * scale)),
+            maxLineGap=max(1, round(5 * scale))
         )
         
         if lines is None or len(lines) < 3:
@@ -129,12 +179,13 @@ class DiagramDetector:
         contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
         
         # Diagrams typically have multiple enclosed regions
-        closed_shapes = sum(1 for cnt in contours if cv2.contourArea(cnt) > 100)
+        min_shape_area = 100 * scale * scale
+        closed_shapes = sum(1 for cnt in contours if cv2.contourArea(cnt) > min_shape_area)
         
         # Heuristic: multiple lines + enclosed shapes = likely diagram
         return len(lines) >= 5 or closed_shapes >= 2
     
-    def _create_text_only_image(self, img, diagram_regions):
+    def _create_text_only_image(self, img, diagram_regions, prefix="page"):
         """
         Create version of image with diagrams masked out
         """
@@ -145,7 +196,7 @@ class DiagramDetector:
         #     x, y, w, h = region['bbox']
         #     cv2.rectangle(text_only, (x, y), (x+w, y+h), (255, 255, 255), -1)
         
-        text_only_path = "temp/text_only.png"
+        text_only_path = f"temp/{prefix}_text_only.png"
         cv2.imwrite(text_only_path, text_only)
         
         return text_only_path
\ No newline at end of file